@@ -1,296 +1,435 @@
+import atexit
+import hashlib
 import math
+import mmap
+import os
+import signal
+import sys
 import threading
-import psutil
 import time
-from flask import Flask, render_template, jsonify
+from collections import deque
+
+from flask import Flask, Response, g, jsonify, render_template, request
+
+from control import CONTROL_SOCKET, ControlClient, LoadControl
+from kernels import KERNELS
+from logutil import get_logger
+from metrics import CONTENT_TYPE, Registry
+from stream import Broadcaster
 
 app = Flask(__name__)
+log = get_logger('app')
+
+# Behind a multi-worker server every worker talks to the one supervisor process that owns the loaders;
+# run on its own, the app owns them directly
+if CONTROL_SOCKET:
+    control = ControlClient()
+else:
+    control = LoadControl(sample_interval=float(os.environ.get('SAMPLE_INTERVAL', 0.5)),
+                          sample_history=int(os.environ.get('SAMPLE_HISTORY', 3600)))
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.errorhandler(ConnectionError)
+def supervisor_unavailable(e):
+    return jsonify(message=f"Load supervisor unavailable: {e}"), 503
+
+
+def _bounded_arg(name, default, limit=None):
+    value = float(request.args.get(name, default))
+    if not math.isfinite(value) or value < 0 or (limit is not None and value > limit):
+        raise ValueError(f"{name} must be between 0 and {limit:g}" if limit is not None
+                         else f"{name} must be a finite, non-negative number")
+    return value
 
-# Global instances of the loaders
-cpu_loader = None
-memory_loader_running = False
-memory_data = []  # Global reference to allocated memory
-
-class CPULoader:
-    def __init__(self, target_percent=60, check_interval=1.0):
-        """
-        Initialize a CPU loader that targets a specific load percentage
-
-        Args:
-            target_percent: Target CPU utilization (0-100%)
-            check_interval: How often to adjust the load (seconds)
-        """
-        self.target_percent = min(max(target_percent, 0), 100)
-        self.check_interval = check_interval
-        self.running = False
-        self.processes = []
-        self.monitor_thread = None
-        self.intensity = 5000  # Starting intensity value - will be adjusted dynamically
-
-    def _cpu_worker(self):
-        """Worker process that performs calculations in bursts"""
-        thread = threading.current_thread()
-        while getattr(thread, "running", True):
-            # Perform genuinely CPU-intensive operations using pure Python
-            for _ in range(self.intensity):
-                # Matrix multiplication simulation (CPU intensive)
-                size = 20  # Small matrix size to simulate
-                matrix_a = [[math.sin(i * j) for j in range(size)] for i in range(size)]
-                matrix_c = [[0 for _ in range(size)] for _ in range(size)]
-
-                # Manual matrix multiplication is very CPU intensive
-                for i in range(size):
-                    for j in range(size):
-                        for k in range(size):
-                            matrix_c[i][j] += matrix_a[i][k] * math.cos(k * j)
-
-                # Additional math operations that cannot be easily optimized
-                result = 0
-                for i in range(100):
-                    result += math.sin(i) * math.cos(i * 0.5) / (math.sqrt(i + 1) + 0.001)
-
-    def _monitor_and_adjust(self):
-        """Monitors CPU usage and adjusts worker processes and intensity"""
-        while self.running:
-            # Get current CPU usage
-            current_percent = psutil.cpu_percent(interval=self.check_interval)
-            # Log current status
-            print(
-                f"Current CPU: {current_percent:.1f}% | Target: {self.target_percent}% | Workers: {len(self.processes)} | Intensity: {self.intensity}")
-            # Dynamically adjust intensity based on how far we are from target
-            if current_percent < self.target_percent - 10:
-                # Significantly increase intensity if we're way below target
-                self.intensity = int(self.intensity * 1.5)
-                print(f"⬆️ Increased intensity to {self.intensity}")
-            elif current_percent < self.target_percent - 5:
-                # Moderate increase
-                self.intensity = int(self.intensity * 1.2)
-                print(f"↗️ Moderately increased intensity to {self.intensity}")
-            elif current_percent > self.target_percent + 10:
-                # Significantly decrease intensity if we're way above target
-                self.intensity = max(100, int(self.intensity * 0.5))
-                print(f"⬇️ Decreased intensity to {self.intensity}")
-            elif current_percent > self.target_percent + 5:
-                # Moderate decrease
-                self.intensity = max(100, int(self.intensity * 0.8))
-                print(f"↘️ Moderately decreased intensity to {self.intensity}")
-
-            # Adjust number of processes only if intensity adjustment isn't enough
-            if current_percent < self.target_percent - 15 and len(self.processes) < psutil.cpu_count():
-                # Add a worker if significantly below target
-                new_process = threading.Thread(target=self._cpu_worker)
-                new_process.running = True
-                new_process.daemon = True
-                new_process.start()
-                self.processes.append(new_process)
-                print(f"➕ Added worker ({len(self.processes)} total)")
-
-            elif current_percent > self.target_percent + 15 and len(self.processes) > 1:
-                # Remove a worker if significantly above target
-                if self.processes:
-                    process = self.processes.pop()
-                    process.running = False
-                    print(f"➖ Removed worker ({len(self.processes)} total)")
-
-    def start(self, duration=None):
-        """
-        Start generating the specified CPU load
-
-        Args:
-            duration: How long to run in seconds (None = run until stop() is called)
-        """
-        if self.running:
-            print("Already running")
-            return
-
-        self.running = True
-        print(f"Starting CPU load test targeting {self.target_percent}% utilization...")
-
-        # Start with a sensible number of workers (about half the available cores)
-        initial_workers = max(1, psutil.cpu_count() // 2)
-        for _ in range(initial_workers):
-            new_process = threading.Thread(target=self._cpu_worker)
-            new_process.running = True
-            new_process.daemon = True
-            new_process.start()
-            self.processes.append(new_process)
-
-        print(f"Started with {initial_workers} workers")
-
-        # Start the monitoring thread
-        self.monitor_thread = threading.Thread(target=self._monitor_and_adjust)
-        self.monitor_thread.daemon = True
-        self.monitor_thread.start()
-
-        if duration is not None:
-            time.sleep(duration)
-            self.stop()
-
-    def stop(self):
-        """Stop the CPU load test"""
-        if not self.running:
-            return
-
-        self.running = False
-
-        # Stop all worker processes
-        for process in self.processes:
-            process.running = False
-
-        self.processes = []
-        print("CPU load test stopped")
-
-
-def simulate_memory_load():
-    """Simulate memory load that can be stopped externally"""
-    global memory_loader_running, memory_data
-
-    # Set flag
-    memory_loader_running = True
-
-    # Clear any previous data
-    memory_data = []
-
-    # Get current memory stats
-    mem = psutil.virtual_memory()
-    total_memory = mem.total
-    available_memory = mem.available
-
-    # Target 60% of AVAILABLE memory, not total
-    target_memory_usage = available_memory * 0.6
-    allocated_memory = 0
-
-    print(f"Starting memory load test targeting 60% of available memory ({available_memory / (1024 ** 3):.2f} GB)")
 
+def _memory_target_args(args):
+    """Parse a memory target from mb/bytes/target_percent query parameters"""
+    if 'bytes' in args:
+        return {'target_bytes': int(_bounded_arg('bytes', 0))}
+    if 'mb' in args:
+        return {'target_bytes': _bounded_arg('mb', 0) * 1024 ** 2}
+    # The loader checks the upper bound of request-relative targets, which depends on the pod
+    basis = args.get('basis', 'limit')
+    return {'target_percent': _bounded_arg('target_percent', 60, 100 if basis == 'limit' else None), 'basis': basis}
+
+
+@app.route('/start-memory-load', methods=['GET'])
+def start_memory_load():
+    """
+    Start a memory load test
+
+    Query parameters (all optional):
+        target_percent: Target working set as a percentage of the pod memory limit (default 60)
+        basis: 'request' to make target_percent relative to the pod memory request, as the HPA measures it
+        mb / bytes: Exact amount of memory to hold instead
+        ramp_rate: Maximum allocation speed in MB/s (default: as fast as possible)
+        retouch_interval: Seconds between rewrites of every held page (default: never)
+    """
+    args = request.args
     try:
-        # Use larger chunks for faster allocation
-        chunk_size = 10 ** 7  # 10 MB per allocation
+        target_bytes = control.start_memory(
+            ramp_rate=float(args['ramp_rate']) if 'ramp_rate' in args else None,
+            retouch_interval=float(args['retouch_interval']) if 'retouch_interval' in args else None,
+            **_memory_target_args(args))
+    except ValueError as e:
+        return jsonify(message=f"Invalid memory load parameters: {e}"), 400
 
-        while allocated_memory < target_memory_usage and memory_loader_running:
-            # Allocate larger chunks for faster memory consumption
-            chunk = 'a' * chunk_size
-            memory_data.append(chunk)
-            allocated_memory += len(chunk)
+    return jsonify(message=f"Memory load test started targeting {target_bytes / (1024 ** 2):.0f} MB. "
+                           "Check the logs for details.")
 
-            # Print progress after each larger chunk
-            current_usage = psutil.virtual_memory().percent
-            print(f"Allocated {allocated_memory / (1024 ** 2):.2f} MB, Total system usage: {current_usage}%")
 
-            # Check if we should stop
-            if not memory_loader_running:
-                break
+@app.route('/resize-memory-load', methods=['GET'])
+def resize_memory_load():
+    """Move a running memory load test to a new target (same mb/bytes/target_percent/basis parameters)"""
+    try:
+        target_bytes = control.resize_memory(**_memory_target_args(request.args))
+    except ValueError as e:
+        return jsonify(message=f"Invalid memory load parameters: {e}"), 400
+    if target_bytes is None:
+        return jsonify(message="No memory load test currently running."), 409
+    return jsonify(message=f"Memory load test resizing to {target_bytes / (1024 ** 2):.0f} MB.")
 
-            # Safety check - stop if overall memory usage exceeds 60%
-            if psutil.virtual_memory().percent > 60:
-                print("Safety limit reached (80% total memory), stopping")
-                break
 
-            # No sleep between allocations to speed things up
+@app.route('/stop-memory-load', methods=['GET'])
+def stop_memory_load():
+    if control.stop_memory():
+        return jsonify(message="Memory load test stopped.")
+    else:
+        return jsonify(message="No memory load test currently running.")
 
-        print(f"Memory allocation complete: {allocated_memory / (1024 ** 2):.2f} MB")
 
-        # Keep the memory load until stopped
-        while memory_loader_running:
-            current_usage = psutil.virtual_memory().percent
-            print(f"Holding memory load, current system usage: {current_usage}%")
-            time.sleep(5)  # Report status every 5 seconds
+@app.route('/start-cpu-load', methods=['GET'])
+def start_cpu_load():
+    """
+    Start a CPU load test
+
+    Query parameters (all optional):
+        target_percent: Closed-loop target as a percentage of the pod CPU limit (default 60)
+        basis: 'request' to make target_percent relative to the pod CPU request, as the HPA measures it
+        millicores / cores: Absolute amount of CPU to burn, driven open-loop from the kernel calibration;
+                            capped at the pod CPU limit
+        kernel: Work kernel to run (float, int or memory)
+        feedback: 1/0 to force closed-loop refinement on or off
+    """
+    args = request.args
+    try:
+        millicores = None
+        if 'millicores' in args:
+            millicores = float(args['millicores'])
+        elif 'cores' in args:
+            millicores = float(args['cores']) * 1000
+        feedback = None
+        if 'feedback' in args:
+            feedback = args['feedback'].lower() in ('1', 'true', 'yes', 'on')
+        basis = args.get('basis', 'limit')
+        loader = control.start_cpu(target_percent=float(args.get('target_percent', 60)), millicores=millicores,
+                                   kernel=args.get('kernel', 'float'), feedback=feedback, basis=basis)
+    except ValueError as e:
+        return jsonify(message=f"Invalid CPU load parameters: {e}"), 400
+
+    if loader['millicores'] is not None:
+        target = f"{loader['millicores']:.0f}m of CPU ({'closed' if loader['feedback'] else 'open'}-loop)"
+    elif basis == 'request':
+        target = (f"{float(args.get('target_percent', 60)):g}% of the pod CPU request "
+                  f"({loader['target_percent']:.3g}% of the limit)")
+    else:
+        target = f"{loader['target_percent']:g}% of the pod CPU limit"
+    return jsonify(message=f"CPU load test started targeting {target}. Check the logs for details.")
 
-    except MemoryError:
-        print("Memory limit reached, but was caught early!")
-    finally:
-        # Make sure to clear memory if this function exits for any reason
-        if not memory_loader_running:
-            stop_memory_load_internal()
 
+@app.route('/stop-cpu-load', methods=['GET'])
+def stop_cpu_load():
+    if control.stop_cpu():
+        return jsonify(message="CPU load test stopped.")
+    else:
+        return jsonify(message="No CPU load test currently running.")
 
-def stop_memory_load_internal():
-    """Internal function to clean up memory load"""
-    global memory_loader_running, memory_data
 
-    memory_loader_running = False
+# Where /start-traffic sends requests by default: this pod's own CPU-costed endpoint
+TRAFFIC_TARGET = os.environ.get('TRAFFIC_TARGET', f"http://127.0.0.1:{os.environ.get('PORT', 5000)}/work/cpu?ms=10")
 
-    # Calculate memory to be freed
-    memory_to_free = sum(len(chunk) for chunk in memory_data) / (1024 ** 2)
 
-    # Clear the list to free memory
-    memory_data.clear()
+@app.route('/start-traffic', methods=['GET'])
+def start_traffic():
+    """
+    Start sending HTTP traffic, to exercise request-driven scaling
 
-    # Force garbage collection
-    import gc
-    gc.collect()
+    Query parameters (all optional):
+        url: Target URL (default TRAFFIC_TARGET, this pod's /work/cpu?ms=10); its host must be
+             listed in TRAFFIC_ALLOWED_HOSTS, so add the LoadBalancer there to load every replica
+        rps: Open-loop request rate, at most 2000; without it requests are sent closed-loop at `concurrency`
+        concurrency: Requests kept in flight in closed-loop mode (default 10, at most 256)
+        duration: Seconds to send for (default 60, at most 3600)
+        connections: Keep-alive connections to use (at most 256)
+        method: Request method (default GET; GET, HEAD, POST, PUT, PATCH, DELETE or OPTIONS)
+    """
+    args = request.args
+    try:
+        state = control.start_traffic(url=args.get('url', TRAFFIC_TARGET),
+                                      rps=_bounded_arg('rps', 0, 2000) if 'rps' in args else None,
+                                      concurrency=int(_bounded_arg('concurrency', 10, 256)),
+                                      duration=_bounded_arg('duration', 60, 3600),
+                                      connections=int(_bounded_arg('connections', 0, 256)) or None,
+                                      method=args.get('method', 'GET'))
+    except ValueError as e:
+        return jsonify(message=f"Invalid traffic parameters: {e}"), 400
+
+    if state['mode'] == 'rate':
+        shape = f"{state['target_rps']:g} requests/s"
+    else:
+        shape = f"{state['concurrency']} concurrent requests"
+    return jsonify(message=f"Traffic started: {shape} to {state['url']} for {state['duration']:g}s.", traffic=state)
 
-    print(f"Memory load test stopped, freed approximately {memory_to_free:.2f} MB")
 
+@app.route('/stop-traffic', methods=['GET'])
+def stop_traffic():
+    state = control.stop_traffic()
+    if state is None:
+        return jsonify(message="No traffic currently running.")
+    return jsonify(message="Traffic stopped.", traffic=state)
 
-@app.route('/')
-def index():
-    return render_template('index.html')
 
+@app.route('/traffic', methods=['GET'])
+def traffic():
+    """Progress of the running traffic generator, or the results of the last one"""
+    return jsonify(control.traffic_state())
 
-@app.route('/start-memory-load', methods=['GET'])
-def start_memory_load():
-    global memory_loader_running
 
-    # Stop any existing memory load
-    if memory_loader_running:
-        stop_memory_load_internal()
+# Random input for /work/hash, generated once so requests only pay for the hashing
+_hash_input = os.urandom(1024 * 1024)
 
-    # Run the memory load test in a separate thread
-    threading.Thread(target=simulate_memory_load, daemon=True).start()
-    return jsonify(message="Memory load test started targeting 60% of total memory. Check the logs for details.")
 
+@app.route('/work/cpu', methods=['GET'])
+def work_cpu():
+    """Spend `ms` milliseconds of CPU time (default 10, at most 1000) in the request thread"""
+    try:
+        seconds = _bounded_arg('ms', 10, 1000) / 1000
+    except ValueError as e:
+        return jsonify(message=f"Invalid work parameters: {e}"), 400
+
+    run = KERNELS['float']()
+    iterations = 0
+    deadline = time.thread_time() + seconds
+    while time.thread_time() < deadline:
+        run()
+        iterations += 1
+    return jsonify(ms=seconds * 1000, iterations=iterations)
+
+
+@app.route('/work/hash', methods=['GET'])
+def work_hash():
+    """SHA-256 `kb` KiB of data (default 64, at most 1024) `rounds` times (default 1, at most 1000)"""
+    try:
+        size = int(_bounded_arg('kb', 64, 1024) * 1024)
+        rounds = int(_bounded_arg('rounds', 1, 1000))
+    except ValueError as e:
+        return jsonify(message=f"Invalid work parameters: {e}"), 400
+
+    data = memoryview(_hash_input)[:size]
+    digest = b''
+    for _ in range(rounds):
+        # Chain the rounds so none of them can be skipped
+        hasher = hashlib.sha256(digest)
+        hasher.update(data)
+        digest = hasher.digest()
+    return jsonify(kb=size / 1024, rounds=rounds, digest=digest.hex())
+
+
+@app.route('/work/alloc', methods=['GET'])
+def work_alloc():
+    """Allocate and touch `mb` MiB (default 8, at most 256), released when the request ends"""
+    try:
+        size = int(_bounded_arg('mb', 8, 256) * 1024 ** 2)
+    except ValueError as e:
+        return jsonify(message=f"Invalid work parameters: {e}"), 400
 
-@app.route('/stop-memory-load', methods=['GET'])
-def stop_memory_load():
-    global memory_loader_running
+    buffer = bytearray(size)
+    # A fresh bytearray is lazily zeroed by the kernel, so write one byte per page to make it resident
+    buffer[::mmap.PAGESIZE] = b'\x01' * len(range(0, size, mmap.PAGESIZE))
+    return jsonify(mb=size / 1024 ** 2)
 
-    if memory_loader_running:
-        stop_memory_load_internal()
-        return jsonify(message="Memory load test stopped.")
-    else:
-        return jsonify(message="No memory load test currently running.")
 
+# Finished requests waiting to be added to the HTTP metrics, which live with the loaders
+_pending_requests = deque()
 
-@app.route('/start-cpu-load', methods=['GET'])
-def start_cpu_load():
-    global cpu_loader
 
-    # Stop any existing CPU loader
-    if cpu_loader and cpu_loader.running:
-        cpu_loader.stop()
+def _flush_request_metrics():
+    batch = []
+    while _pending_requests:
+        batch.append(_pending_requests.popleft())
+    if batch:
+        control.record_requests(requests=batch)
 
-    # Create and start a new CPU loader
-    cpu_loader = CPULoader(target_percent=60)  # Target 60% CPU load
 
-    # Start in a separate thread to avoid blocking the web server
-    threading.Thread(target=cpu_loader.start, daemon=True).start()
+def _flush_request_metrics_forever(interval=1.0):
+    while True:
+        time.sleep(interval)
+        try:
+            _flush_request_metrics()
+        except Exception:
+            log.exception('request_metrics_flush_failed')
 
-    return jsonify(message="CPU load test started targeting 60% utilization. Check the logs for details.")
 
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        _pending_requests.append((request.method, route, response.status_code, time.perf_counter() - started))
+    return response
+
+
+def _float_option(args, name, default):
+    """A number from query parameters or a JSON body, where it may also be null or a list"""
+    try:
+        return float(args.get(name, default))
+    except TypeError:
+        raise ValueError(f"{name} must be a number")
+
+
+def _start_profile(args, timeline=None, trace=None):
+    """Replace any running profile with one configured from query parameters"""
+    state = control.start_profile(timeline=timeline, trace=trace,
+                                  tick=_float_option(args, 'tick', 0.5), speed=_float_option(args, 'speed', 1),
+                                  loop=str(args.get('loop', '')).lower() in ('1', 'true', 'yes', 'on'))
+    return jsonify(message=f"Load profile started ({state['segments']} segments, {state['duration']:g}s timeline).",
+                   profile=state)
+
+
+@app.route('/profile', methods=['GET', 'POST'])
+def load_profile():
+    """
+    GET returns the current profile state. POST starts a timeline:
+
+        {"segments": [{"type": "ramp", "duration": 60, "cpu": [10, 80], "memory": [20, 50]},
+                      {"type": "sine", "duration": 120, "cpu": {"mean": 50, "amplitude": 20, "period": 30}}],
+         "loop": false, "speed": 1, "tick": 0.5}
+
+    Setpoints are percentages of the pod limits; see profiles.Segment for every segment type.
+    """
+    if request.method == 'GET':
+        return jsonify(control.profile_state())
+
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify(message="Expected a JSON load profile."), 400
+    try:
+        options = {**request.args, **(data if isinstance(data, dict) else {})}
+        return _start_profile(options, timeline=data)
+    except ValueError as e:
+        return jsonify(message=f"Invalid load profile: {e}"), 400
+
+
+@app.route('/profile/replay', methods=['POST'])
+def replay_profile():
+    """
+    Replay a recorded utilization trace: a /history response or JSON Lines with timestamp,
+    cpu_percent and memory_percent per line. Use ?speed=60 to compress an hour into a minute.
+    """
+    try:
+        return _start_profile(request.args, trace=request.get_data())
+    except ValueError as e:
+        return jsonify(message=f"Invalid trace: {e}"), 400
+
+
+@app.route('/profile/<action>', methods=['GET', 'POST'])
+def control_profile(action):
+    """Pause, resume or abort the running profile"""
+    if action not in ('pause', 'resume', 'abort'):
+        return jsonify(message=f"Unknown profile action '{action}'."), 404
+    state = control.profile_action(action=action)
+    if state is None:
+        return jsonify(message="No load profile currently running."), 409
+
+    return jsonify(message=f"Load profile {action}{'d' if action.endswith('e') else 'ed'}.", profile=state)
+
+
+# Each worker streams to its own clients, so a worker polls the status once per frame however many are connected.
+# Every open stream holds one of the worker's threads, so only half of them may stream and the rest stay free
+# for the other routes; clients turned away fall back to polling /status.
+STATUS_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STATUS_STREAM_MAX_SUBSCRIBERS',
+                                                   max(1, int(os.environ.get('WEB_THREADS', 16)) // 2)))
+status_stream = Broadcaster(control.status, interval=1 / float(os.environ.get('STATUS_STREAM_FPS', 4)),
+                            max_subscribers=STATUS_STREAM_MAX_SUBSCRIBERS)
+
+# Metrics that belong to this web worker rather than to the loaders
+web_registry = Registry()
+web_registry.callback_gauge('loadgen_status_stream_subscribers', 'Open /status/stream connections per web worker',
+                            lambda: [({'worker': os.getpid()}, status_stream.subscribers)], labels=('worker',))
 
-@app.route('/stop-cpu-load', methods=['GET'])
-def stop_cpu_load():
-    global cpu_loader
-    if cpu_loader and cpu_loader.running:
-        cpu_loader.stop()
-        return jsonify(message="CPU load test stopped.")
-    else:
-        return jsonify(message="No CPU load test currently running.")
 
 @app.route('/status', methods=['GET'])
 def status():
-    # Get CPU usage with a very short interval to get current value
-    cpu_percent = psutil.cpu_percent(interval=0.1)
-    memory = psutil.virtual_memory()
-    memory_percent = memory.percent
+    # The sampler keeps the latest reading ready, so this never blocks on a measurement
+    return jsonify(control.status())
+
+
+@app.route('/status/stream', methods=['GET'])
+def status_stream_events():
+    """
+    Server-Sent Events feed of /status: a full frame first, then only changed fields
+
+    At most STATUS_STREAM_MAX_SUBSCRIBERS clients stream from each worker; others get a 503.
 
-    return jsonify({
-        'cpu_percent': cpu_percent,
-        'memory_percent': memory_percent,
-        'cpu_test_running': cpu_loader.running if cpu_loader else False,
-        'memory_test_running': memory_loader_running,
-        'timestamp': time.time()  # Add timestamp to prevent caching
-    })
+    Query parameters (optional):
+        fps: Frames per second for this client, up to STATUS_STREAM_FPS (default 4)
+    """
+    try:
+        fps = float(request.args.get('fps', 0))
+    except ValueError:
+        return jsonify(message="Invalid fps."), 400
+
+    subscription = status_stream.subscribe(interval=1 / fps if fps > 0 else None)
+    if subscription is None:
+        return jsonify(message="Too many status streams open; poll /status instead."), 503
+
+    def events():
+        # Ask browsers to reconnect quickly if the stream drops
+        yield "retry: 2000\n\n"
+        yield from status_stream.events(subscription)
+
+    return Response(events(), mimetype='text/event-stream', headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/history', methods=['GET'])
+def history():
+    """
+    Sampled time series with min/max/avg/p95 aggregates
+
+    Query parameters (all optional):
+        since: Unix timestamp to start from; negative values mean seconds before now
+        until: Unix timestamp to end at
+        fields: Comma-separated subset of the sampled fields
+    """
+    args = request.args
+    try:
+        since = float(args['since']) if 'since' in args else None
+        if since is not None and since < 0:
+            since += time.time()
+        until = float(args['until']) if 'until' in args else None
+        fields = [f for f in args.get('fields', '').split(',') if f] or None
+        result = control.history(since=since, until=until, fields=fields)
+    except ValueError as e:
+        return jsonify(message=f"Invalid history parameters: {e}"), 400
+
+    return jsonify(result)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Load generator internals in the Prometheus text exposition format"""
+    _flush_request_metrics()
+    return Response(control.render_metrics() + web_registry.render(), content_type=CONTENT_TYPE)
 
 
 # To ensure Flask doesn't cache responses
@@ -302,5 +441,23 @@ def add_header(response):
     return response
 
 
+def shutdown_loaders(signum=None, frame=None):
+    """Stop every running load test; also installed as the SIGTERM handler"""
+    control.shutdown()
+    if signum is not None:
+        sys.exit(0)
+
+
+threading.Thread(target=_flush_request_metrics_forever, name="request-metrics-flush", daemon=True).start()
+
+if not CONTROL_SOCKET:
+    control.start()
+
+    # Make sure no worker processes outlive the pod's main process
+    atexit.register(shutdown_loaders)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, shutdown_loaders)
+
+
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=int(os.environ.get('PORT', 5000)))
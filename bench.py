@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import kernels
+from controller import StepResponse
+from logutil import get_logger, log_event
+from traffic import ConnectionPool, LatencyHistogram, TrafficGenerator
+
+log = get_logger('bench')
+
+# Settling band for the CPU step responses (percentage points), matching the controller's own
+CPU_BAND = 2.0
+
+# name suffix -> (unit, direction that is better, absolute slack below which a change is treated as noise)
+METRIC_KINDS = {
+    'time_to_target_s': ('s', 'lower', 1.0),
+    'settling_time_s': ('s', 'lower', 1.0),
+    'overshoot_pct': ('pct', 'lower', 2.0),
+    'steady_state_error_pct': ('pct', 'lower', 1.0),
+    'stdev_pct': ('pct', 'lower', 1.0),
+    'error_mb': ('MiB', 'lower', 8.0),
+    'stdev_mb': ('MiB', 'lower', 4.0),
+    'p50_ms': ('ms', 'lower', 2.0),
+    'p99_ms': ('ms', 'lower', 5.0),
+    'throughput_rps': ('rps', 'higher', 10.0),
+}
+
+# Length of each phase in seconds: (time allowed to reach a target, window measured once there)
+DURATIONS = {
+    'full': {'settle': 20.0, 'hold': 10.0, 'traffic': 10.0, 'rounds': 20},
+    'quick': {'settle': 10.0, 'hold': 5.0, 'traffic': 4.0, 'rounds': 8},
+}
+
+
+class Server:
+    def __init__(self, kind='gunicorn', sample_interval=0.25):
+        """
+        The app under test, started in a child process on a free local port
+
+        Args:
+            kind: gunicorn (the production entrypoint) or flask (python app.py)
+            sample_interval: SAMPLE_INTERVAL for the server, so the step responses are finely resolved
+        """
+        self.kind = kind
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, 'PORT': str(self.port), 'SAMPLE_INTERVAL': str(sample_interval),
+                    'LOADGEN_CONTROL_SOCKET': os.path.join(tempfile.gettempdir(), f"loadgen-bench-{self.port}.sock")}
+        self.process = None
+
+    def __enter__(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        if self.kind == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', '2', 'app:app']
+        else:
+            command = [sys.executable, 'app.py']
+            self.env.pop('LOADGEN_CONTROL_SOCKET')
+        self.process = subprocess.Popen(command, cwd=here, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                self.get('/status')
+                return self
+            except (URLError, ConnectionError):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.__exit__()
+                    raise RuntimeError(f"The {self.kind} server did not start")
+                time.sleep(0.25)
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def get(self, path):
+        with urlopen(self.base_url + path, timeout=30) as response:
+            return json.loads(response.read())
+
+
+def _stdev(values):
+    if len(values) < 2:
+        return 0.0
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+def _wait_until(server, since, seconds, field, done):
+    """Poll /history until done(value) holds for the newest sample of `field`, or `seconds` have passed"""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        time.sleep(0.5)
+        values = server.get(f"/history?since={since}&fields={field}")['series'][field]
+        if values and values[-1] is not None and done(values[-1]):
+            return
+
+
+def _wait_idle(server, threshold=10.0, timeout=15.0):
+    """Give the pod time to go quiet (worker start-up, kernel calibration, the previous phase)"""
+    _wait_until(server, time.time(), timeout, 'cpu_percent', done=lambda value: value < threshold)
+
+
+def bench_cpu_step(server, target, durations):
+    """Step from idle to `target` percent of the CPU limit and measure the response from /history"""
+    initial = server.get('/status')['cpu_percent'] or 0.0
+    started = time.time()
+    server.get(f"/start-cpu-load?target_percent={target}")
+    window = durations['settle'] + durations['hold']
+    time.sleep(window)
+    history = server.get(f"/history?since={started}&fields=cpu_percent")
+    server.get('/stop-cpu-load')
+
+    samples = [(t, v) for t, v in zip(history['timestamps'], history['series']['cpu_percent']) if v is not None]
+    response = StepResponse(target, initial, band=CPU_BAND)
+    response.started_at = started
+    for t, value in samples:
+        response.record(value, now=t)
+    reached = next((t - started for t, value in samples if abs(value - target) <= CPU_BAND), None)
+    steady = [value for t, value in samples if t >= started + durations['settle']]
+
+    prefix = f"cpu_{target:g}"
+    return {
+        f"{prefix}_time_to_target_s": reached,
+        # A step that never settles counts as the whole window, so it still compares as a number
+        f"{prefix}_settling_time_s": response.settling_time if response.settled else window,
+        f"{prefix}_overshoot_pct": response.overshoot,
+        f"{prefix}_steady_state_error_pct": abs(sum(steady) / len(steady) - target) if steady else None,
+        f"{prefix}_stdev_pct": _stdev(steady),
+    }
+
+
+def bench_memory(server, target_mb, durations):
+    """Hold `target_mb` of memory and compare the pod's working set against it"""
+    baseline = server.get('/status')['memory_bytes']
+    target = target_mb * 1024 ** 2
+    started = time.time()
+    server.get(f"/start-memory-load?mb={target_mb}")
+    _wait_until(server, started, durations['settle'], 'memory_allocated_bytes',
+                done=lambda allocated: allocated >= target)
+    allocated = server.get(f"/history?since={started}&fields=memory_allocated_bytes")
+    reached = next((t - started for t, value in zip(allocated['timestamps'],
+                                                    allocated['series']['memory_allocated_bytes'])
+                    if value is not None and value >= target), None)
+    time.sleep(durations['hold'])
+    history = server.get(f"/history?since={time.time() - durations['hold']}&fields=memory_bytes")
+    server.get('/stop-memory-load')
+
+    held = [(value - baseline) / 1024 ** 2 for value in history['series']['memory_bytes'] if value is not None]
+    return {
+        'memory_time_to_target_s': reached,
+        'memory_error_mb': abs(sum(held) / len(held) - target_mb) if held else None,
+        'memory_stdev_mb': _stdev(held),
+    }
+
+
+async def _time_endpoints(base_url, paths, rounds):
+    """Call each path in turn `rounds` times over keep-alive connections; returns a histogram per path"""
+    pools = {path: ConnectionPool(base_url + path, 1) for path in paths}
+    histograms = {path: LatencyHistogram() for path in paths}
+    try:
+        for _ in range(rounds):
+            for path in paths:
+                started = time.perf_counter()
+                status, _ = await pools[path].send()
+                if status >= 400:
+                    raise RuntimeError(f"{path} returned {status}")
+                histograms[path].record_seconds(time.perf_counter() - started)
+    finally:
+        for pool in pools.values():
+            pool.close()
+    return histograms
+
+
+def bench_web(server, durations):
+    """Endpoint latency and /status throughput while both loaders are running"""
+    server.get('/start-cpu-load?target_percent=60')
+    server.get('/start-memory-load?mb=128')
+    time.sleep(2)
+    try:
+        status = asyncio.run(TrafficGenerator(server.base_url + '/status', concurrency=4,
+                                              duration=durations['traffic']).run())
+        # The start endpoints replace whatever is running, so the loaders stay active between rounds
+        histograms = asyncio.run(_time_endpoints(
+            server.base_url, ['/start-cpu-load?target_percent=60', '/stop-cpu-load',
+                              '/start-memory-load?mb=64', '/stop-memory-load'],
+            durations['rounds']))
+    finally:
+        server.get('/stop-cpu-load')
+        server.get('/stop-memory-load')
+
+    results = {
+        'status_p50_ms': status['latency_ms']['p50'],
+        'status_p99_ms': status['latency_ms']['p99'],
+        'status_throughput_rps': status['throughput_rps'],
+    }
+    for path, histogram in histograms.items():
+        name = path.strip('/').split('?')[0].replace('-load', '').replace('-', '_')
+        summary = histogram.as_dict()
+        results[f"{name}_p50_ms"] = summary['p50']
+        results[f"{name}_p99_ms"] = summary['p99']
+    return results
+
+
+def _kind(name):
+    return next((kind for suffix, kind in METRIC_KINDS.items() if name.endswith(suffix)), ('', 'lower', 0.0))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare metrics against a baseline run
+
+    A metric regresses when it is worse than the baseline by more than `tolerance`
+    (a fraction of the baseline value) and by more than its absolute slack.
+
+    Returns:
+        List of {metric, baseline, current, change, regressed}
+    """
+    rows = []
+    for name, current in results['metrics'].items():
+        previous = baseline.get('metrics', {}).get(name)
+        if previous is None or current is None:
+            rows.append({'metric': name, 'baseline': previous, 'current': current, 'change': None,
+                         # A target that used to be reached and now isn't is a regression
+                         'regressed': previous is not None and current is None})
+            continue
+        _, better, slack = _kind(name)
+        worse_by = current - previous if better == 'lower' else previous - current
+        rows.append({
+            'metric': name,
+            'baseline': previous,
+            'current': current,
+            'change': (current - previous) / previous if previous else None,
+            'regressed': worse_by > max(tolerance * abs(previous), slack),
+        })
+    return rows
+
+
+def run(server_kind='gunicorn', quick=False, cpu_targets=(30, 60), memory_mb=256):
+    durations = DURATIONS['quick' if quick else 'full']
+    metrics = {}
+    with Server(server_kind) as server:
+        status = server.get('/status')
+        for target in cpu_targets:
+            _wait_idle(server)
+            log_event(log, 'bench_phase', phase='cpu_step', target_percent=target)
+            metrics.update(bench_cpu_step(server, target, durations))
+        _wait_idle(server)
+        log_event(log, 'bench_phase', phase='memory', target_mb=memory_mb)
+        metrics.update(bench_memory(server, memory_mb, durations))
+        log_event(log, 'bench_phase', phase='web')
+        metrics.update(bench_web(server, durations))
+
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'server': server_kind,
+            'quick': quick,
+            'cpu_model': kernels._cpu_model(),
+            'python': platform.python_version(),
+            'cpu_limit_cores': status['cpu_limit_cores'],
+            'memory_limit_bytes': status['memory_limit_bytes'],
+        },
+        'metrics': metrics,
+    }
+
+
+def _format(value):
+    return 'n/a' if value is None else f"{value:.4g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark load-controller accuracy and endpoint latency, optionally against a baseline")
+    parser.add_argument('--output', '-o', help="Write the results JSON here (default: stdout)")
+    parser.add_argument('--baseline', '-b', help="Baseline results to compare against; exits 1 on a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results to --baseline instead")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed fractional worsening before a metric counts as regressed (default 0.25)")
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn')
+    parser.add_argument('--quick', action='store_true', help="Shorter phases, for a smoke run")
+    args = parser.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    # Keep stdout for the results; progress events go to stderr
+    for handler in logging.getLogger('loadgen').handlers:
+        handler.setStream(sys.stderr)
+
+    results = run(server_kind=args.server, quick=args.quick)
+    regressed = []
+    if args.baseline and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results['comparison'] = compare(results, baseline, args.tolerance)
+        regressed = [row['metric'] for row in results['comparison'] if row['regressed']]
+        for row in results['comparison']:
+            change = '' if row['change'] is None else f"{row['change']:+.1%}"
+            print(f"{'REGRESSED' if row['regressed'] else 'ok':>9}  {row['metric']:<36} "
+                  f"{_format(row['baseline']):>10} -> {_format(row['current']):<10} {change}", file=sys.stderr)
+
+    text = json.dumps(results, indent=2) + '\n'
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    elif not args.save_baseline:
+        sys.stdout.write(text)
+
+    if regressed:
+        print(f"{len(regressed)} metric(s) regressed: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
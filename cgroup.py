@@ -0,0 +1,219 @@
+import math
+import os
+import time
+import psutil
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# cgroup v1 reports "unlimited" memory as a page-aligned LONG_MAX
+_V1_UNLIMITED = 1 << 62
+
+# Resource requests set from the Downward API (resourceFieldRef requests.cpu with divisor 1m, requests.memory);
+# the cgroup files only carry a rounded CPU weight and nothing at all for the memory request
+CPU_REQUEST_ENV = 'CPU_REQUEST_MILLICORES'
+MEMORY_REQUEST_ENV = 'MEMORY_REQUEST_BYTES'
+
+
+def _read(path):
+    """Return the stripped contents of a file, or None if it cannot be read"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    value = _read(path)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_keyed(path):
+    """Parse a flat-keyed cgroup file such as cpu.stat or memory.stat"""
+    values = {}
+    for line in (_read(path) or '').splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip('-').isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def _env_number(name):
+    """Positive number from an environment variable, or None if it is unset or invalid"""
+    try:
+        value = float(os.environ[name])
+    except (KeyError, ValueError):
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
+
+def _allowed_cpu_count():
+    """Number of cores this process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return psutil.cpu_count()
+
+
+class CgroupStats:
+    def __init__(self, root=CGROUP_ROOT):
+        """
+        Measure CPU and memory of the current container relative to its own limits
+
+        Reads cgroup v2 or v1 accounting files under `root` and falls back to
+        node-wide psutil counters when no cgroup hierarchy is found, so the
+        same numbers work inside a pod and on a developer machine.
+
+        Args:
+            root: Mount point of the cgroup filesystem (point it at a fake tree to test)
+        """
+        self.root = root
+        self.version = self._detect_version()
+        self._last_sample = None  # (monotonic time, cumulative CPU seconds)
+
+    def _path(self, controller, name):
+        if self.version == 2:
+            return os.path.join(self.root, name)
+        # v1 controllers are either mounted separately or co-mounted as "cpu,cpuacct"
+        for directory in (controller, 'cpu,cpuacct', 'cpuacct,cpu'):
+            path = os.path.join(self.root, directory, name)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.root, controller, name)
+
+    def _detect_version(self):
+        if os.path.exists(os.path.join(self.root, 'cgroup.controllers')):
+            return 2
+        for directory in ('cpuacct', 'cpu,cpuacct', 'cpuacct,cpu'):
+            if os.path.exists(os.path.join(self.root, directory, 'cpuacct.usage')):
+                return 1
+        return None
+
+    @property
+    def in_container(self):
+        return self.version is not None
+
+    def cpu_limit(self):
+        """CPU limit in cores (CFS quota / period), or the usable core count if unlimited"""
+        cores = _allowed_cpu_count()
+        if self.version == 2:
+            fields = (_read(self._path('cpu', 'cpu.max')) or 'max').split()
+            if fields[0] != 'max' and len(fields) == 2:
+                cores = min(cores, int(fields[0]) / int(fields[1]))
+        elif self.version == 1:
+            quota = _read_int(self._path('cpu', 'cpu.cfs_quota_us'))
+            period = _read_int(self._path('cpu', 'cpu.cfs_period_us'))
+            if quota and quota > 0 and period:
+                cores = min(cores, quota / period)
+        return cores
+
+    def cpu_request(self):
+        """
+        CPU request in cores, or None if it isn't known
+
+        The HPA computes utilization against this value. It is read from
+        CPU_REQUEST_MILLICORES when the Downward API sets it. Otherwise it is
+        derived from the scheduler weight: Kubernetes turns the request into
+        cpu.shares (v1) and maps those onto cpu.weight (v2), and this inverts
+        that mapping. The v2 weight is coarse for small requests (100m comes
+        back as 79m), so set the variable in the deployment.
+        """
+        millicores = _env_number(CPU_REQUEST_ENV)
+        if millicores is not None:
+            return millicores / 1000
+        if self.version == 2:
+            weight = _read_int(self._path('cpu', 'cpu.weight'))
+            if weight is None:
+                return None
+            shares = 2 + (weight - 1) * 262142 / 9999
+        elif self.version == 1:
+            shares = _read_int(self._path('cpu', 'cpu.shares'))
+            if shares is None:
+                return None
+        else:
+            return None
+        return shares / 1024
+
+    def cpu_usage(self):
+        """Cumulative CPU time consumed by the container (seconds)"""
+        if self.version == 2:
+            usage = _read_keyed(self._path('cpu', 'cpu.stat')).get('usage_usec')
+            if usage is not None:
+                return usage / 1e6
+        elif self.version == 1:
+            usage = _read_int(self._path('cpuacct', 'cpuacct.usage'))
+            if usage is not None:
+                return usage / 1e9
+        times = psutil.cpu_times()
+        return sum(times) - times.idle - getattr(times, 'iowait', 0.0)
+
+    def cpu_percent(self, interval=None):
+        """
+        CPU utilization as a percentage of the container's CPU limit
+
+        Args:
+            interval: Seconds to sample over; None compares against the previous call
+                      without blocking (the first call returns 0.0)
+        """
+        if interval is not None:
+            start = (time.monotonic(), self.cpu_usage())
+            time.sleep(interval)
+        else:
+            start = self._last_sample
+        sample = (time.monotonic(), self.cpu_usage())
+        if interval is None:
+            self._last_sample = sample
+        if start is None or sample[0] <= start[0]:
+            return 0.0
+        cores_used = (sample[1] - start[1]) / (sample[0] - start[0])
+        return max(0.0, 100.0 * cores_used / self.cpu_limit())
+
+    def memory_limit(self):
+        """Memory limit in bytes, or total physical memory if unlimited"""
+        total = psutil.virtual_memory().total
+        if self.version == 2:
+            limit = _read(self._path('memory', 'memory.max'))
+            if limit and limit != 'max':
+                return min(total, int(limit))
+        elif self.version == 1:
+            limit = _read_int(self._path('memory', 'memory.limit_in_bytes'))
+            if limit and limit < _V1_UNLIMITED:
+                return min(total, limit)
+        return total
+
+    def memory_request(self):
+        """Memory request in bytes from MEMORY_REQUEST_BYTES, or None if it isn't set"""
+        request = _env_number(MEMORY_REQUEST_ENV)
+        return int(request) if request is not None else None
+
+    def memory_usage(self):
+        """
+        Working-set memory of the container in bytes
+
+        This is usage minus inactive file cache, the same figure the kubelet
+        reports to the metrics server and the HPA.
+        """
+        if self.version == 2:
+            usage = _read_int(self._path('memory', 'memory.current'))
+            inactive_key = 'inactive_file'
+        elif self.version == 1:
+            usage = _read_int(self._path('memory', 'memory.usage_in_bytes'))
+            inactive_key = 'total_inactive_file'
+        else:
+            usage = None
+        if usage is None:
+            memory = psutil.virtual_memory()
+            return memory.total - memory.available
+        inactive = _read_keyed(self._path('memory', 'memory.stat')).get(inactive_key, 0)
+        return max(0, usage - inactive)
+
+    def memory_percent(self):
+        """Working-set memory as a percentage of the container's memory limit"""
+        return 100.0 * self.memory_usage() / self.memory_limit()
+
+    def max_workers(self):
+        """How many busy worker processes it takes to saturate the CPU limit"""
+        return max(1, min(_allowed_cpu_count(), math.ceil(self.cpu_limit())))
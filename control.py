@@ -0,0 +1,519 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import psutil
+
+import kernels
+from loaders import CPULoader, MemoryLoader, pod_stats
+from logutil import get_logger, log_event
+from metrics import Registry
+from profiles import ProfileScheduler, parse_timeline, parse_trace
+from sampler import Sampler
+from traffic import PERCENTILES, TrafficGenerator, check_target
+
+log = get_logger('control')
+
+# Set for every process of a multi-worker deployment; without it the web app runs the loaders in-process
+CONTROL_SOCKET = os.environ.get('LOADGEN_CONTROL_SOCKET')
+AUTHKEY = os.environ.get('LOADGEN_AUTHKEY', 'loadgen').encode()
+
+# Everything the background sampler records, in order
+SAMPLE_FIELDS = (
+    'cpu_percent', 'memory_percent', 'memory_bytes',
+    'cpu_test_running', 'cpu_target_percent', 'cpu_workers', 'cpu_duty',
+    'cpu_output_percent', 'cpu_error', 'cpu_integral',
+    'memory_test_running', 'memory_target_bytes', 'memory_allocated_bytes',
+)
+
+PROFILE_ACTIONS = ('pause', 'resume', 'abort')
+
+
+def _profile_channels(segments):
+    return {name for segment in segments for name in segment.channels}
+
+
+class LoadControl:
+    # Methods a ControlClient may call over the control socket
+    COMMANDS = (
+        'start_cpu', 'stop_cpu', 'start_memory', 'resize_memory', 'stop_memory',
+        'start_profile', 'profile_state', 'profile_action',
+        'start_traffic', 'stop_traffic', 'traffic_state',
+        'status', 'history', 'record_requests', 'render_metrics',
+    )
+
+    def __init__(self, sample_interval=0.5, sample_history=3600):
+        """
+        Owner of one pod's load generators, profile scheduler, sampler and metrics
+
+        Exactly one of these exists per pod: inside the web process when it runs
+        alone, or inside the supervisor process behind a multi-worker server.
+
+        Args:
+            sample_interval: Seconds between metric samples
+            sample_history: Number of samples kept for /history
+        """
+        self.cpu_loader = None
+        self.memory_loader = None
+        self.profile = None  # Scheduler driving both loaders from a timeline
+        self.traffic = None  # Most recent HTTP traffic generator, kept after it finishes for its results
+        self._lock = threading.RLock()
+        self._process = psutil.Process()
+
+        # Pod limits only change if the pod is resized in place, so they are read once
+        self.pod_limits = {
+            'cpu_limit_cores': pod_stats.cpu_limit(),
+            'cpu_request_cores': pod_stats.cpu_request(),
+            'memory_limit_bytes': pod_stats.memory_limit(),
+            'memory_request_bytes': pod_stats.memory_request(),
+        }
+        self.sampler = Sampler(self._collect_sample, SAMPLE_FIELDS, interval=sample_interval,
+                               capacity=sample_history)
+        self.registry = Registry()
+        self._register_metrics()
+
+    def start(self):
+        # Measure the work kernels up front so the first CPU load test starts on target
+        threading.Thread(target=kernels.calibrate_all, daemon=True).start()
+        self.sampler.start()
+
+    def shutdown(self):
+        """Stop every running load test"""
+        # Aborting joins the scheduler thread, whose finish callback takes the lock
+        profile = self.profile
+        if profile and profile.running:
+            profile.abort()
+        with self._lock:
+            if self.traffic and self.traffic.running:
+                self.traffic.stop()
+            if self.cpu_loader and self.cpu_loader.running:
+                self.cpu_loader.stop()
+            if self.memory_loader:
+                self.memory_loader.stop()
+        self.sampler.stop()
+
+    @property
+    def _cpu(self):
+        return self.cpu_loader if self.cpu_loader and self.cpu_loader.running else None
+
+    @property
+    def _memory(self):
+        return self.memory_loader if self.memory_loader and self.memory_loader.running else None
+
+    def start_cpu(self, target_percent=60, millicores=None, kernel='float', feedback=None, basis='limit'):
+        """Replace any running CPU load test with a new one; returns its effective target"""
+        loader = CPULoader(target_percent=target_percent, millicores=millicores, kernel=kernel, feedback=feedback,
+                           basis=basis)
+        with self._lock:
+            if self._cpu:
+                self.cpu_loader.stop()
+            self.cpu_loader = loader
+        # Start in a separate thread so a pending kernel calibration doesn't hold up the caller
+        threading.Thread(target=loader.start, daemon=True).start()
+        return {'target_percent': loader.target_percent, 'millicores': loader.millicores, 'feedback': loader.feedback}
+
+    def stop_cpu(self):
+        """Stop the CPU load test; returns whether one was running"""
+        with self._lock:
+            if not self._cpu:
+                return False
+            self.cpu_loader.stop()
+            return True
+
+    def start_memory(self, target_bytes=None, target_percent=60, ramp_rate=None, retouch_interval=None,
+                     basis='limit'):
+        """Replace any running memory load test with a new one; returns its target in bytes"""
+        loader = MemoryLoader(target_bytes=target_bytes, target_percent=target_percent, ramp_rate=ramp_rate,
+                              retouch_interval=retouch_interval, basis=basis)
+        with self._lock:
+            if self.memory_loader:
+                self.memory_loader.stop()
+            self.memory_loader = loader
+            loader.start()
+        return loader.target_bytes
+
+    def resize_memory(self, target_bytes=None, target_percent=None, basis='limit'):
+        """Move the running memory load test to a new target; returns it in bytes, or None if none is running"""
+        with self._lock:
+            if not self._memory:
+                return None
+            self.memory_loader.resize(target_bytes=target_bytes, target_percent=target_percent, basis=basis)
+            return self.memory_loader.target_bytes
+
+    def stop_memory(self):
+        """Stop the memory load test; returns whether one was running"""
+        with self._lock:
+            if not self._memory:
+                return False
+            self.memory_loader.stop()
+            return True
+
+    def _apply_profile_setpoints(self, setpoints):
+        """Drive the loaders to a profile's setpoints, starting them on first use"""
+        with self._lock:
+            if 'cpu' in setpoints:
+                target = min(max(setpoints['cpu'], 0), 100)
+                if self._cpu:
+                    if self.cpu_loader.target_percent != target:
+                        self.cpu_loader.set_target(target)
+                else:
+                    self.cpu_loader = CPULoader(target_percent=target)
+                    self.cpu_loader.start()
+
+            if 'memory' in setpoints:
+                # Rounded so a slowly moving setpoint doesn't resize the mappings on every tick
+                target = round(min(max(setpoints['memory'], 0), 100), 1)
+                if self._memory:
+                    if self.memory_loader.target_percent != target:
+                        self.memory_loader.resize(target_percent=target)
+                else:
+                    self.memory_loader = MemoryLoader(target_percent=target)
+                    self.memory_loader.start()
+
+    def start_profile(self, timeline=None, trace=None, tick=0.5, speed=1.0, loop=False):
+        """
+        Replace any running profile with a new one; returns its state
+
+        Args:
+            timeline: Parsed JSON timeline (see profiles.parse_timeline)
+            trace: Recorded trace to replay instead (see profiles.parse_trace)
+            tick: Seconds between setpoint updates
+            speed: Timeline seconds played per wall-clock second
+            loop: Restart when the timeline ends
+        """
+        segments = parse_trace(trace) if trace is not None else parse_timeline(timeline)
+        channels = _profile_channels(segments)
+
+        def finish():
+            # Release the loaders the profile was driving once it ends or is aborted,
+            # unless a newer profile has taken them over
+            with self._lock:
+                if self.profile is scheduler:
+                    self._release(channels)
+
+        scheduler = ProfileScheduler(segments, self._apply_profile_setpoints, on_finish=finish,
+                                     tick=tick, speed=speed, loop=loop)
+        with self._lock:
+            previous, self.profile = self.profile, scheduler
+        if previous and previous.running:
+            # Outside the lock: abort() joins the scheduler thread, and its finish() needs the lock
+            previous.abort()
+            with self._lock:
+                self._release(_profile_channels(previous.segments) - channels)
+        scheduler.start()
+        return scheduler.state()
+
+    def _release(self, channels):
+        """Stop the loaders for these profile channels; the caller holds the lock"""
+        if 'cpu' in channels and self.cpu_loader:
+            self.cpu_loader.stop()
+        if 'memory' in channels and self.memory_loader:
+            self.memory_loader.stop()
+
+    def profile_state(self):
+        return self.profile.state() if self.profile else {'running': False}
+
+    def profile_action(self, action):
+        """Pause, resume or abort the running profile; returns its state, or None if none is running"""
+        if action not in PROFILE_ACTIONS:
+            raise ValueError(f"Unknown profile action '{action}'")
+        profile = self.profile
+        if not (profile and profile.running):
+            return None
+        getattr(profile, action)()
+        return profile.state()
+
+    def start_traffic(self, url, rps=None, concurrency=10, duration=60, connections=None, method='GET'):
+        """Replace any running traffic generator with a new one; returns its initial results"""
+        check_target(url)
+        generator = TrafficGenerator(url, rps=rps, concurrency=concurrency, duration=duration,
+                                     connections=connections, method=method)
+        with self._lock:
+            if self.traffic and self.traffic.running:
+                self.traffic.stop()
+            self.traffic = generator
+            generator.start()
+        return generator.results()
+
+    def stop_traffic(self):
+        """Stop the traffic generator; returns its results, or None if it wasn't running"""
+        with self._lock:
+            if not (self.traffic and self.traffic.running):
+                return None
+            self.traffic.stop()
+            return self.traffic.results()
+
+    def traffic_state(self):
+        return self.traffic.results() if self.traffic else {'running': False}
+
+    def _collect_sample(self):
+        """Read the pod's usage and the loaders' internals for the sampler"""
+        cpu = self._cpu
+        memory = self._memory
+        memory_bytes = pod_stats.memory_usage()
+        return (
+            pod_stats.cpu_percent(),
+            100.0 * memory_bytes / self.pod_limits['memory_limit_bytes'],
+            memory_bytes,
+            cpu is not None,
+            cpu.target_percent if cpu else None,
+            len(cpu.processes) if cpu else 0,
+            cpu.duty if cpu else None,
+            cpu.controller.output if cpu else None,
+            cpu.controller.error if cpu else None,
+            cpu.controller.integral if cpu else None,
+            memory is not None,
+            memory.target_bytes if memory else None,
+            memory.allocated_bytes if memory else 0,
+        )
+
+    def status(self):
+        """The latest sample plus loader and profile state, as served by /status and /status/stream"""
+        sample = self.sampler.latest()
+        cpu_request = self.pod_limits['cpu_request_cores']
+        memory_request = self.pod_limits['memory_request_bytes']
+        cpu, memory, profile = self._cpu, self._memory, self.profile
+
+        return {
+            **sample,
+            **self.pod_limits,
+            # Utilization against the CPU request, which is what the HPA compares to its target
+            'cpu_request_percent': (sample['cpu_percent'] * self.pod_limits['cpu_limit_cores'] / cpu_request
+                                    if cpu_request else None),
+            'memory_request_percent': sample['memory_bytes'] * 100 / memory_request if memory_request else None,
+            'cpu_test_running': cpu is not None,
+            'memory_test_running': memory is not None,
+            'memory_loader': memory.state() if memory else None,
+            'cpu_controller': cpu.state() if cpu else None,
+            'profile': profile.state() if profile and profile.running else None,
+            'traffic': self.traffic.results() if self.traffic and self.traffic.running else None,
+        }
+
+    def history(self, since=None, until=None, fields=None):
+        return {'interval': self.sampler.interval, **self.sampler.history(since, until, fields)}
+
+    def _register_metrics(self):
+        # Loader values are read at scrape time so the hot paths only update plain attributes
+        registry = self.registry
+
+        def latest(field):
+            sample = self.sampler.latest()
+            return sample[field] if sample else None
+
+        def cpu_state(attribute, default=0):
+            value = getattr(self._cpu, attribute, None)
+            return default if value is None else value
+
+        def memory_state(attribute):
+            return getattr(self._memory, attribute, 0)
+
+        def worker_rates():
+            cpu = self._cpu
+            return [({'worker': slot}, rate)
+                    for slot, rate in enumerate(cpu.iteration_rates[:len(cpu.processes)])] if cpu else []
+
+        def worker_iterations():
+            cpu = self.cpu_loader
+            return [({'worker': slot, 'kernel': cpu.kernel}, count)
+                    for slot, count in enumerate(cpu._iterations)] if cpu else []
+
+        registry.callback_gauge('loadgen_pod_cpu_utilization_percent', 'Pod CPU usage as a percentage of its CPU limit',
+                                lambda: latest('cpu_percent'))
+        registry.callback_gauge('loadgen_pod_memory_working_set_bytes', 'Pod working-set memory',
+                                lambda: latest('memory_bytes'))
+        registry.callback_gauge('loadgen_pod_memory_utilization_percent',
+                                'Pod working set as a percentage of its memory limit',
+                                lambda: latest('memory_percent'))
+        registry.callback_gauge('loadgen_cpu_workers', 'Active CPU worker processes',
+                                lambda: len(self._cpu.processes) if self._cpu else 0)
+        registry.callback_gauge('loadgen_cpu_setpoint_percent', 'CPU load target as a percentage of the pod CPU limit',
+                                lambda: cpu_state('target_percent'))
+        registry.callback_gauge('loadgen_cpu_measured_percent', 'CPU usage seen by the controller at its last update',
+                                lambda: cpu_state('current_percent'))
+        registry.callback_gauge('loadgen_cpu_controller_error_percent', 'Controller error (setpoint - measured)',
+                                lambda: self._cpu.controller.error if self._cpu else 0)
+        registry.callback_gauge('loadgen_cpu_controller_output_percent',
+                                'Controller output (demanded CPU, percent of limit)',
+                                lambda: (self._cpu.controller.output or 0) if self._cpu else 0)
+        registry.callback_gauge('loadgen_cpu_duty_ratio', 'Busy fraction of each worker time slice',
+                                lambda: cpu_state('duty'))
+        registry.callback_counter('loadgen_cpu_kernel_iterations_total', 'Kernel iterations completed per worker slot',
+                                  worker_iterations, labels=('worker', 'kernel'))
+        registry.callback_gauge('loadgen_cpu_kernel_iterations_per_second', 'Kernel iteration rate per active worker',
+                                worker_rates, labels=('worker',))
+        registry.callback_gauge('loadgen_memory_target_bytes', 'Memory load target',
+                                lambda: memory_state('target_bytes'))
+        registry.callback_gauge('loadgen_memory_allocated_bytes', 'Memory held (and touched) by the memory loader',
+                                lambda: memory_state('allocated_bytes'))
+        registry.callback_gauge('loadgen_process_resident_memory_bytes', 'Resident memory of the process that owns the loaders',
+                                lambda: self._process.memory_info().rss)
+        registry.callback_counter('loadgen_traffic_requests_total', 'Requests sent by the traffic generator',
+                                  lambda: self.traffic.sent if self.traffic else 0)
+        registry.callback_counter('loadgen_traffic_errors_total', 'Traffic generator requests that failed, by reason',
+                                  lambda: [({'reason': reason}, count) for reason, count in
+                                           self.traffic.errors.items()] if self.traffic else [],
+                                  labels=('reason',))
+        registry.callback_gauge('loadgen_traffic_latency_seconds',
+                                'Traffic generator latency percentiles (from the intended send time)',
+                                lambda: [({'quantile': f"{percent / 100:g}"}, self.traffic.latency.percentile(percent) / 1e6)
+                                         for percent in PERCENTILES] if self.traffic and self.traffic.latency.count
+                                else [],
+                                labels=('quantile',))
+        self.http_requests = registry.counter('loadgen_http_requests_total', 'HTTP requests handled',
+                                              labels=('method', 'route', 'status'))
+        self.http_latency = registry.histogram('loadgen_http_request_duration_seconds',
+                                               'HTTP request latency per route', labels=('method', 'route'))
+
+    def record_requests(self, requests):
+        """Add (method, route, status, seconds) entries from the web tier to the HTTP metrics"""
+        for method, route, status, seconds in requests:
+            self.http_requests.inc(method=method, route=route, status=status)
+            self.http_latency.observe(seconds, method=method, route=route)
+
+    def render_metrics(self):
+        return self.registry.render()
+
+
+class ControlClient:
+    def __init__(self, address=CONTROL_SOCKET, authkey=AUTHKEY, connect_timeout=10.0):
+        """
+        Proxy that forwards LoadControl calls to the supervisor over its Unix socket
+
+        Each thread keeps its own connection, since a connection carries one
+        request/response exchange at a time.
+
+        Args:
+            address: Path of the supervisor's control socket
+            authkey: Shared secret the supervisor was started with
+            connect_timeout: How long to keep retrying while the supervisor starts up (seconds)
+        """
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    connection = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() >= deadline:
+                        raise ConnectionError(f"Load supervisor is not listening on {self.address}")
+                    time.sleep(0.1)
+            self._local.connection = connection
+        return connection
+
+    def call(self, command, **kwargs):
+        # A connection can go stale if the supervisor restarted; reconnect once before giving up
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.send((command, kwargs))
+                reply = connection.recv()
+                break
+            except (EOFError, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise ConnectionError("Lost the connection to the load supervisor")
+
+        if reply[0] == 'ok':
+            return reply[1]
+        if reply[1] == 'ValueError':
+            raise ValueError(reply[2])
+        raise RuntimeError(f"Load supervisor failed: {reply[1]}: {reply[2]}")
+
+    def __getattr__(self, command):
+        if command not in LoadControl.COMMANDS:
+            raise AttributeError(command)
+        return lambda **kwargs: self.call(command, **kwargs)
+
+
+def _handle_connection(control, connection):
+    """Serve one client's requests until it disconnects"""
+    with connection:
+        while True:
+            try:
+                command, kwargs = connection.recv()
+            except (EOFError, OSError):
+                return
+
+            if command not in LoadControl.COMMANDS:
+                reply = ('error', 'ValueError', f"Unknown command '{command}'")
+            else:
+                try:
+                    reply = ('ok', getattr(control, command)(**kwargs))
+                except ValueError as e:
+                    reply = ('error', 'ValueError', str(e))
+                except Exception as e:
+                    log.exception('command_failed')
+                    reply = ('error', type(e).__name__, str(e))
+
+            try:
+                connection.send(reply)
+            except OSError:
+                return
+
+
+def serve(control, address=CONTROL_SOCKET, authkey=AUTHKEY):
+    """Accept control connections on a Unix socket until interrupted"""
+    if os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    os.chmod(address, 0o600)
+    log_event(log, 'supervisor_listening', address=address, pid=os.getpid())
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # A client with the wrong key or one that hung up mid-handshake
+                log_event(log, 'connection_rejected', logging.WARNING, error=str(e))
+                continue
+            threading.Thread(target=_handle_connection, args=(control, connection), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def _watch_parent(parent_pid):
+    """Shut the supervisor down if the server that started it goes away without stopping it"""
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def main():
+    """Run the load supervisor: one per pod, owning every load generator"""
+    if not CONTROL_SOCKET:
+        sys.exit("LOADGEN_CONTROL_SOCKET must be set to run the load supervisor")
+
+    control = LoadControl(sample_interval=float(os.environ.get('SAMPLE_INTERVAL', 0.5)),
+                          sample_history=int(os.environ.get('SAMPLE_HISTORY', 3600)))
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threading.Thread(target=_watch_parent, args=(os.getppid(),), daemon=True).start()
+
+    control.start()
+    try:
+        serve(control)
+    finally:
+        control.shutdown()
+        if os.path.exists(CONTROL_SOCKET):
+            os.unlink(CONTROL_SOCKET)
+        log_event(log, 'supervisor_stopped')
+
+
+if __name__ == '__main__':
+    main()
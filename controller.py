@@ -0,0 +1,190 @@
+import time
+
+
+class StepResponse:
+    def __init__(self, setpoint, initial, band=2.0, hold=2.0):
+        """
+        Track how a measured signal responds to a setpoint change
+
+        The signal counts as settled once it has stayed inside the band for
+        `hold` seconds, so a noisy sample passing through the band doesn't.
+
+        Args:
+            setpoint: The new setpoint
+            initial: The measurement when the setpoint changed
+            band: Half-width of the settling band, in the measurement's units
+            hold: Seconds the signal must stay inside the band to count as settled
+        """
+        self.setpoint = setpoint
+        self.initial = initial
+        self.band = band
+        self.hold = hold
+        self.started_at = time.monotonic()
+        self.samples = 0
+        self._elapsed = 0.0  # Seconds after the step of the latest sample
+        self._entered = None  # Seconds after the step the signal last entered the band, None while outside
+        self._peak = initial
+        self._settled_error_sum = 0.0
+        self._settled_samples = 0
+
+    def record(self, measurement, now=None):
+        """Add a measurement taken `now` (monotonic seconds, defaults to the current time)"""
+        self._elapsed = (time.monotonic() if now is None else now) - self.started_at
+        self.samples += 1
+        error = self.setpoint - measurement
+        if abs(error) > self.band:
+            self._entered = None
+            self._settled_error_sum = 0.0
+            self._settled_samples = 0
+        else:
+            if self._entered is None:
+                self._entered = self._elapsed
+            self._settled_error_sum += error
+            self._settled_samples += 1
+        if self.setpoint >= self.initial:
+            self._peak = max(self._peak, measurement)
+        else:
+            self._peak = min(self._peak, measurement)
+
+    @property
+    def settled(self):
+        return self._entered is not None and self._elapsed - self._entered >= self.hold
+
+    @property
+    def settling_time(self):
+        """Seconds from the step until the signal entered the band for good, or None if not yet settled"""
+        return self._entered if self.settled else None
+
+    @property
+    def overshoot(self):
+        """How far the signal went past the setpoint in the direction of the step"""
+        if self.setpoint >= self.initial:
+            return max(0.0, self._peak - self.setpoint)
+        return max(0.0, self.setpoint - self._peak)
+
+    @property
+    def steady_state_error(self):
+        """Mean error (setpoint - measurement) since settling, or None if not yet settled"""
+        if not self.settled:
+            return None
+        return self._settled_error_sum / self._settled_samples
+
+    def as_dict(self):
+        return {
+            'settling_time': self.settling_time,
+            'overshoot': self.overshoot,
+            'steady_state_error': self.steady_state_error,
+        }
+
+
+class PIDController:
+    def __init__(self, kp, ki, kd=0.0, setpoint=0.0, output_min=0.0, output_max=100.0,
+                 feedforward=True, band=2.0):
+        """
+        PID controller with integrator anti-windup and step-response tracking
+
+        Args:
+            kp: Proportional gain
+            ki: Integral gain (per second)
+            kd: Derivative gain (seconds); applied to the measurement to avoid setpoint kicks
+            setpoint: Initial setpoint
+            output_min: Lower output limit
+            output_max: Upper output limit
+            feedforward: Add the setpoint to the output, for plants whose output tracks input 1:1
+            band: Settling band used for the step-response metrics
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_min = output_min
+        self.output_max = output_max
+        self.feedforward = feedforward
+        self.band = band
+        self.integral = 0.0
+        self.error = 0.0
+        self.output = None
+        self._setpoint = setpoint
+        self._last_measurement = None
+        self.response = None
+
+    @property
+    def setpoint(self):
+        return self._setpoint
+
+    @setpoint.setter
+    def setpoint(self, value):
+        if value != self._setpoint:
+            self._setpoint = value
+            # Start a new step-response record from the latest measurement
+            if self._last_measurement is not None:
+                self.response = StepResponse(value, self._last_measurement, self.band)
+
+    def _clamp(self, value):
+        return min(max(value, self.output_min), self.output_max)
+
+    def initial_output(self):
+        """Output to apply before the first measurement arrives"""
+        return self._clamp(self._setpoint if self.feedforward else 0.0)
+
+    def observe(self, measurement):
+        """Record a measurement for the error and step-response metrics without computing an output"""
+        if self.response is None:
+            self.response = StepResponse(self._setpoint, measurement, self.band)
+        else:
+            self.response.record(measurement)
+        self.error = self._setpoint - measurement
+        self._last_measurement = measurement
+
+    def update(self, measurement, dt):
+        """
+        Feed a new measurement and return the next output
+
+        Args:
+            measurement: Latest measured process value
+            dt: Seconds since the previous update
+        """
+        last_measurement = self._last_measurement
+        self.observe(measurement)
+
+        derivative = 0.0
+        if self.kd and last_measurement is not None and dt > 0:
+            derivative = -self.kd * (measurement - last_measurement) / dt
+
+        base = self._setpoint if self.feedforward else 0.0
+        integral = self.integral + self.ki * self.error * dt
+        unclamped = base + self.kp * self.error + integral + derivative
+        self.output = self._clamp(unclamped)
+
+        # Anti-windup: only let the integrator grow while the output is not saturated,
+        # or when the error is already pulling the output back into range
+        saturated_high = unclamped > self.output_max and self.error > 0
+        saturated_low = unclamped < self.output_min and self.error < 0
+        if not (saturated_high or saturated_low):
+            self.integral = integral
+        return self.output
+
+    def reset(self, measurement=None):
+        """
+        Clear the controller state
+
+        Args:
+            measurement: Process value before the controller takes over; starts the
+                         step-response record now instead of at the first update
+        """
+        self.integral = 0.0
+        self.error = 0.0
+        self.output = None
+        self._last_measurement = None
+        self.response = None if measurement is None else StepResponse(self._setpoint, measurement, self.band)
+
+    @property
+    def settling_time(self):
+        return self.response.settling_time if self.response else None
+
+    @property
+    def overshoot(self):
+        return self.response.overshoot if self.response else None
+
+    @property
+    def steady_state_error(self):
+        return self.response.steady_state_error if self.response else None
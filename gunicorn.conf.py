@@ -0,0 +1,82 @@
+import math
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _here)
+
+from cgroup import CgroupStats  # noqa: E402
+
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# Sized from the pod's CPU limit rather than the node's cores: every worker costs memory the memory load can't use
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, math.ceil(CgroupStats().cpu_limit()) + 1)))
+# Threads let one worker hold several /status/stream connections open; app.py lets at most half of them stream
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+timeout = 60
+graceful_timeout = 20
+
+# The loaders must exist once per pod, not once per worker, so they run in a supervisor process
+# the workers reach over a Unix socket. Set here so every worker inherits them.
+os.environ.setdefault('LOADGEN_CONTROL_SOCKET', '/tmp/loadgen-control.sock')
+os.environ.setdefault('LOADGEN_AUTHKEY', secrets.token_hex(16))
+
+# A supervisor that dies more often than this is left dead and the server exits, so the kubelet restarts the pod
+SUPERVISOR_MAX_RESTARTS = 5
+SUPERVISOR_RESTART_WINDOW = 60.0
+
+_supervisor = None
+_stopping = threading.Event()
+
+
+def _start_supervisor(server):
+    global _supervisor
+    _supervisor = subprocess.Popen([sys.executable, os.path.join(_here, 'control.py')])
+    server.log.info("Started load supervisor (pid %s)", _supervisor.pid)
+
+
+def _watch_supervisor(server):
+    """Restart the supervisor if it dies (it holds the memory load, so it is the likely OOM victim)"""
+    restarts = deque()
+    while not _stopping.is_set():
+        code = _supervisor.wait()
+        if _stopping.is_set():
+            return
+        now = time.monotonic()
+        while restarts and now - restarts[0] > SUPERVISOR_RESTART_WINDOW:
+            restarts.popleft()
+        if len(restarts) >= SUPERVISOR_MAX_RESTARTS:
+            server.log.error("Load supervisor keeps exiting (last code %s); shutting down", code)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        server.log.warning("Load supervisor exited with code %s; restarting it", code)
+        restarts.append(now)
+        time.sleep(1)
+        _start_supervisor(server)
+
+
+def on_starting(server):
+    _start_supervisor(server)
+
+
+def when_ready(server):
+    threading.Thread(target=_watch_supervisor, args=(server,), name="supervisor-watch", daemon=True).start()
+
+
+def on_exit(server):
+    # Runs after the workers have exited on SIGTERM; the supervisor stops its CPU workers and frees its memory
+    _stopping.set()
+    if _supervisor and _supervisor.poll() is None:
+        _supervisor.terminate()
+        try:
+            _supervisor.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _supervisor.kill()
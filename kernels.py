@@ -0,0 +1,191 @@
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import threading
+import time
+
+from logutil import get_logger, log_event
+
+log = get_logger('kernels')
+
+# Where calibration results survive restarts; keyed by CPU model so a cache baked on one node type is ignored on another
+CALIBRATION_CACHE = os.environ.get('KERNEL_CALIBRATION_CACHE', '/tmp/kernel-calibration.json')
+
+# How long each kernel is run for per measurement trial (CPU seconds), and how many trials a calibration takes
+CALIBRATION_SECONDS = 0.2
+CALIBRATION_TRIALS = 5
+
+# Cached calibrations older than this (seconds) are measured again
+CALIBRATION_MAX_AGE = float(os.environ.get('KERNEL_CALIBRATION_MAX_AGE', 24 * 3600))
+# On first use in a process a cached value is checked with one trial and re-measured if it is off by more than this
+CALIBRATION_TOLERANCE = 0.1
+
+_MASK64 = (1 << 64) - 1
+
+
+def _float_kernel():
+    """Pure-Python floating point math"""
+    def run():
+        result = 0
+        for i in range(100):
+            result += math.sin(i) * math.cos(i * 0.5) / (math.sqrt(i + 1) + 0.001)
+        return result
+    return run
+
+
+def _int_kernel():
+    """Integer hashing (64-bit LCG step followed by a xorshift mix)"""
+    state = [0x9E3779B97F4A7C15]
+
+    def run():
+        x = state[0]
+        for _ in range(100):
+            x = (x * 6364136223846793005 + 1442695040888963407) & _MASK64
+            x ^= x >> 33
+        state[0] = x
+        return x
+    return run
+
+
+def _memory_kernel(buffer_size=8 * 1024 * 1024, chunk_size=256 * 1024):
+    """Memory-bandwidth heavy copies through a buffer larger than the CPU caches"""
+    source = bytearray(os.urandom(chunk_size))
+    buffer = bytearray(buffer_size)
+    offset = [0]
+
+    def run():
+        start = offset[0]
+        buffer[start:start + chunk_size] = source
+        offset[0] = (start + chunk_size) % buffer_size
+        return start
+    return run
+
+
+# Each factory returns a zero-argument callable that does one iteration of work
+KERNELS = {
+    'float': _float_kernel,
+    'int': _int_kernel,
+    'memory': _memory_kernel,
+}
+
+_calibration = {}
+_calibration_lock = threading.Lock()
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _cache_key(kernel):
+    return f"{kernel}|{_cpu_model()}|{platform.python_implementation()} {platform.python_version()}"
+
+
+def _load_cache():
+    try:
+        with open(CALIBRATION_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        tmp_path = f"{CALIBRATION_CACHE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, CALIBRATION_CACHE)
+    except OSError as e:
+        log_event(log, 'calibration_cache_write_failed', logging.WARNING, path=CALIBRATION_CACHE, error=str(e))
+
+
+def _trial(run, seconds):
+    """CPU seconds per iteration of `run` over one trial of about `seconds` of CPU time"""
+    iterations = 0
+    batch = 1
+    start = time.thread_time()
+    while True:
+        for _ in range(batch):
+            run()
+        iterations += batch
+        elapsed = time.thread_time() - start
+        if elapsed >= seconds:
+            return elapsed / iterations
+        batch *= 2
+
+
+def measure(kernel, seconds=CALIBRATION_SECONDS, trials=CALIBRATION_TRIALS):
+    """
+    Measure how much CPU time one iteration of a kernel costs on this machine
+
+    Uses thread CPU time rather than wall time so the result is not skewed by
+    CFS throttling or by other processes competing for the core, and takes the
+    median of several trials so one disturbed trial doesn't skew it.
+
+    Args:
+        kernel: Name of a kernel in KERNELS
+        seconds: CPU time to spend on each trial
+        trials: Number of trials
+    """
+    run = KERNELS[kernel]()
+    run()  # Warm up caches and allocate any lazily created state
+    return statistics.median(_trial(run, seconds) for _ in range(trials))
+
+
+def _cached(cache, key):
+    """A cached calibration that is recent enough to use, or None"""
+    entry = cache.get(key)
+    # Older caches held a bare float with no timestamp; treat those as expired
+    if not isinstance(entry, dict) or time.time() - entry.get('measured_at', 0) > CALIBRATION_MAX_AGE:
+        return None
+    return entry.get('seconds_per_iteration')
+
+
+def calibration(kernel, refresh=False):
+    """
+    Seconds of CPU time per iteration of a kernel, measured once per process and cached
+
+    A value from the cache file is only trusted until it expires, and only if
+    a single fresh trial agrees with it, since the same CPU model can run at
+    different speeds on different nodes.
+
+    Args:
+        kernel: Name of a kernel in KERNELS
+        refresh: Ignore cached values and measure again
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}', expected one of: {', '.join(KERNELS)}")
+
+    with _calibration_lock:
+        if not refresh and kernel in _calibration:
+            return _calibration[kernel]
+
+        key = _cache_key(kernel)
+        cache = _load_cache()
+        seconds_per_iteration = None if refresh else _cached(cache, key)
+        if seconds_per_iteration is not None:
+            check = measure(kernel, trials=1)
+            if abs(check - seconds_per_iteration) > CALIBRATION_TOLERANCE * seconds_per_iteration:
+                log_event(log, 'kernel_calibration_stale', kernel=kernel, cached=seconds_per_iteration, measured=check)
+                seconds_per_iteration = None
+        if seconds_per_iteration is None:
+            seconds_per_iteration = measure(kernel)
+            cache[key] = {'seconds_per_iteration': seconds_per_iteration, 'measured_at': time.time()}
+            _save_cache(cache)
+            log_event(log, 'kernel_calibrated', kernel=kernel, seconds_per_iteration=seconds_per_iteration)
+        _calibration[kernel] = seconds_per_iteration
+        return seconds_per_iteration
+
+
+def calibrate_all(refresh=False):
+    """Calibrate every kernel; returns {kernel: seconds per iteration}"""
+    return {kernel: calibration(kernel, refresh=refresh) for kernel in KERNELS}
@@ -0,0 +1,537 @@
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import kernels
+from cgroup import CgroupStats
+from controller import PIDController
+from kernels import KERNELS
+from logutil import get_logger, log_event
+
+log = get_logger('loaders')
+
+# Worker processes only touch shared memory, so forking is safe and avoids re-importing the app
+_mp = multiprocessing.get_context('fork')
+
+# Measures the pod against its own cgroup limits rather than the whole node
+pod_stats = CgroupStats()
+
+
+def _check_range(name, value, low=0.0, high=None):
+    """Reject NaN, infinities and out-of-range values before they reach a loader"""
+    if not math.isfinite(value) or value < low or (high is not None and value > high):
+        bounds = f"between {low:g} and {high:g}" if high is not None else f"at least {low:g}"
+        raise ValueError(f"{name} must be {bounds}")
+    return value
+
+
+# What a target percentage is relative to: the pod's limit, or its request as the HPA measures utilization
+TARGET_BASES = ('limit', 'request')
+
+
+def _limit_percent(name, target_percent, basis, request, limit):
+    """Validate a target given as a percentage of the request or limit and return it as a percentage of the limit"""
+    if basis not in TARGET_BASES:
+        raise ValueError(f"Unknown basis '{basis}', expected one of: {', '.join(TARGET_BASES)}")
+    if basis == 'limit':
+        return _check_range(name, target_percent, high=100)
+    if not request:
+        raise ValueError("The pod's request is unknown; set it from the Downward API to target relative to it")
+    # A target above the limit can't be reached, so the request basis goes up to limit / request
+    return _check_range(name, target_percent, high=100 * limit / request) * request / limit
+
+
+# Length of one worker work/sleep cycle; a worker with duty d is busy for d * SLICE_SECONDS of each slice
+SLICE_SECONDS = 0.01
+# How often a worker re-derives the cost of an iteration from its own CPU time (seconds)
+COST_CHECK_SECONDS = 1.0
+
+
+def _cpu_worker(slot, active, duty, iterations_done, parent_pid, kernel, seconds_per_iteration):
+    """
+    Worker process that alternates fixed busy and idle time slices
+
+    The busy part of each slice runs a calibrated number of kernel iterations,
+    so every slice costs the same CPU time regardless of the node type.
+
+    Args:
+        slot: Index of this worker's flag in the shared active array
+        active: Shared array of per-worker run flags (1 = keep working)
+        duty: Shared value holding the busy fraction of each slice (0.0-1.0)
+        iterations_done: Shared array of per-worker kernel iteration counters
+        parent_pid: PID of the loader process; the worker exits if it goes away
+        kernel: Name of the work kernel to run (see kernels.KERNELS)
+        seconds_per_iteration: Calibrated CPU cost of one kernel iteration; the worker starts from it
+                               and then corrects it from its own CPU time, which also covers the
+                               overhead of its loop and sleeps that the calibration never sees
+    """
+    # The loader process handles SIGTERM for the whole group
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    run = KERNELS[kernel]()
+    # Check the clock about every half millisecond of work
+    batch = max(1, int(0.0005 / seconds_per_iteration))
+    owed = 0.0
+    cost = seconds_per_iteration
+    check_at, check_cpu, check_iterations = time.monotonic(), time.thread_time(), 0
+
+    slice_start = time.monotonic()
+    while active[slot] and os.getppid() == parent_pid:
+        # Carry fractional iterations over so low duty cycles stay accurate
+        owed += duty.value * SLICE_SECONDS / cost
+        iterations = int(owed)
+        owed -= iterations
+
+        deadline = slice_start + SLICE_SECONDS
+        done = 0
+        while done < iterations and time.monotonic() < deadline:
+            step = min(batch, iterations - done)
+            for _ in range(step):
+                run()
+            done += step
+        iterations_done[slot] += done
+        check_iterations += done
+
+        if slice_start - check_at >= COST_CHECK_SECONDS:
+            cpu = time.thread_time()
+            if check_iterations:
+                cost = (cpu - check_cpu) / check_iterations
+            check_at, check_cpu, check_iterations = slice_start, cpu, 0
+
+        slice_start += SLICE_SECONDS
+        idle = slice_start - time.monotonic()
+        if idle > 0:
+            time.sleep(idle)
+        else:
+            # Fell behind (e.g. CFS throttling); don't try to catch up with a burst
+            slice_start = time.monotonic()
+            owed = 0.0
+
+
+class CPULoader:
+    def __init__(self, target_percent=60, check_interval=0.5, millicores=None, kernel='float', feedback=None,
+                 basis='limit'):
+        """
+        Initialize a CPU loader that targets a specific load percentage or an absolute amount of CPU
+
+        Workers are separate processes so the load scales past the one core
+        a GIL-bound thread pool can use. Each worker runs short work/sleep
+        slices of a calibrated kernel; a PI controller sets the total CPU
+        demand, which is spread over the fewest workers that can carry it
+        and applied through a shared duty cycle.
+
+        Args:
+            target_percent: Target CPU utilization as a percentage of the pod's CPU limit (or request, see basis)
+            check_interval: How often to adjust the load (seconds)
+            millicores: Absolute CPU to burn (overrides target_percent); capped at the pod's limit
+            kernel: Work kernel the workers run (see kernels.KERNELS)
+            feedback: Refine the load from measured CPU; defaults to True for percentage targets
+                      and False for millicore targets, which are driven open-loop from the calibration
+            basis: Whether target_percent is relative to the pod's CPU 'limit' or its 'request' (as the HPA sees it)
+        """
+        if kernel not in KERNELS:
+            raise ValueError(f"Unknown kernel '{kernel}', expected one of: {', '.join(KERNELS)}")
+
+        self.max_workers = pod_stats.max_workers()
+        self.cpu_limit = pod_stats.cpu_limit()
+        if millicores is not None:
+            millicores = min(_check_range('millicores', millicores), self.cpu_limit * 1000)
+            target_percent = millicores / 10 / self.cpu_limit
+        else:
+            target_percent = _limit_percent('target_percent', target_percent, basis, pod_stats.cpu_request(),
+                                            self.cpu_limit)
+        self.target_percent = target_percent
+        self.millicores = millicores
+        self.kernel = kernel
+        self.feedback = millicores is None if feedback is None else feedback
+        self.check_interval = check_interval
+        self.running = False
+        self.processes = []
+        self.monitor_thread = None
+        self.current_percent = None
+        self.seconds_per_iteration = None
+        self._lock = threading.Lock()
+        self._active = _mp.RawArray('b', self.max_workers)
+        self._duty = _mp.RawValue('d', 0.0)
+        self._iterations = _mp.RawArray('Q', self.max_workers)
+        self.iteration_rates = [0.0] * self.max_workers
+        # Output is the demanded load in percent of the CPU limit; the setpoint feeds forward
+        # since one percent of demand produces roughly one percent of measured load
+        self.controller = PIDController(kp=0.2, ki=0.5, setpoint=self.target_percent,
+                                        output_min=0.0, output_max=100.0 * self.max_workers / self.cpu_limit)
+
+    @property
+    def duty(self):
+        return self._duty.value
+
+    @property
+    def settling_time(self):
+        """Seconds the load took to settle within ±2% of the target, or None while still settling"""
+        return self.controller.settling_time
+
+    @property
+    def overshoot(self):
+        """Largest excursion past the target since it was last changed (percentage points)"""
+        return self.controller.overshoot
+
+    @property
+    def steady_state_error(self):
+        """Mean target - measured CPU since settling (percentage points), or None while still settling"""
+        return self.controller.steady_state_error
+
+    def set_target(self, target_percent):
+        _check_range('target_percent', target_percent, high=100)
+        with self._lock:
+            self.target_percent = target_percent
+            self.controller.setpoint = self.target_percent
+            if self.millicores is not None:
+                self.millicores = round(self.target_percent * self.cpu_limit * 10)
+            if self.running and not self.feedback:
+                self._apply(self.controller.initial_output())
+
+    def state(self):
+        """Snapshot of the loader and controller internals"""
+        return {
+            'target_percent': self.target_percent,
+            'millicores': self.millicores,
+            'kernel': self.kernel,
+            'feedback': self.feedback,
+            'seconds_per_iteration': self.seconds_per_iteration,
+            'current_percent': self.current_percent,
+            'workers': len(self.processes),
+            'duty': self.duty,
+            'iterations_per_second': self.iteration_rates[:len(self.processes)],
+            'output_percent': self.controller.output,
+            'error': self.controller.error,
+            'integral': self.controller.integral,
+            'settling_time': self.settling_time,
+            'overshoot': self.overshoot,
+            'steady_state_error': self.steady_state_error,
+        }
+
+    def _add_worker(self):
+        """Start a worker process in the next free slot"""
+        slot = len(self.processes)
+        self._active[slot] = 1
+        process = _mp.Process(target=_cpu_worker,
+                              args=(slot, self._active, self._duty, self._iterations, os.getpid(),
+                                    self.kernel, self.seconds_per_iteration),
+                              name=f"cpu-worker-{slot}", daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    def _remove_worker(self):
+        """Signal the most recently added worker to finish its current slice and exit"""
+        process = self.processes.pop()
+        self._active[len(self.processes)] = 0
+        process.join(timeout=self.check_interval)
+        if process.is_alive():
+            process.terminate()
+
+    def _apply(self, output_percent):
+        """Spread the demanded load over the fewest workers that can carry it"""
+        cores = output_percent * self.cpu_limit / 100
+        workers = min(self.max_workers, max(1, math.ceil(cores - 1e-6)))
+        while len(self.processes) > workers:
+            self._remove_worker()
+        # Lower the duty before adding workers so the total never spikes
+        self._duty.value = min(1.0, cores / workers)
+        while len(self.processes) < workers:
+            self._add_worker()
+
+    def _monitor_and_adjust(self):
+        """Monitors CPU usage and, with feedback enabled, feeds it to the controller"""
+        last = time.monotonic()
+        last_iterations = list(self._iterations)
+        while self.running:
+            # Get current CPU usage relative to the pod's limit
+            current_percent = pod_stats.cpu_percent(interval=self.check_interval)
+            now = time.monotonic()
+            with self._lock:
+                if not self.running:
+                    break
+                self.current_percent = current_percent
+                iterations = list(self._iterations)
+                self.iteration_rates = [(new - old) / (now - last) for new, old in zip(iterations, last_iterations)]
+                last_iterations = iterations
+                if self.feedback:
+                    self._apply(self.controller.update(current_percent, now - last))
+                else:
+                    self.controller.observe(current_percent)
+                # Log current status
+                log_event(log, 'cpu_control', rate_limit=True, current_percent=round(current_percent, 1),
+                          target_percent=self.target_percent, workers=len(self.processes), duty=round(self.duty, 3))
+            last = now
+
+    def start(self, duration=None):
+        """
+        Start generating the specified CPU load
+
+        Args:
+            duration: How long to run in seconds (None = run until stop() is called)
+        """
+        with self._lock:
+            if self.running:
+                log_event(log, 'cpu_load_already_running', logging.WARNING)
+                return
+
+            self.running = True
+
+            try:
+                # Cached after the first run, so this is normally instant
+                self.seconds_per_iteration = kernels.calibration(self.kernel)
+
+                # Measure the pod before any worker starts, so the step response runs from idle to the target
+                self.controller.reset(measurement=pod_stats.cpu_percent(interval=0.1))
+                # Start from the feed-forward estimate so the load is on target immediately
+                self._apply(self.controller.initial_output())
+            except Exception:
+                # Don't leave a loader that reports running with no workers or monitor behind it
+                self.running = False
+                while self.processes:
+                    self._remove_worker()
+                raise
+            log_event(log, 'cpu_load_started', target_percent=self.target_percent, millicores=self.millicores,
+                      kernel=self.kernel, feedback=self.feedback, workers=len(self.processes))
+
+            # Start the monitoring thread
+            self.monitor_thread = threading.Thread(target=self._monitor_and_adjust)
+            self.monitor_thread.daemon = True
+            self.monitor_thread.start()
+
+        if duration is not None:
+            time.sleep(duration)
+            self.stop()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the CPU load test
+
+        Args:
+            timeout: How long to wait for workers to exit before killing them (seconds)
+        """
+        with self._lock:
+            if not self.running:
+                return
+
+            self.running = False
+
+            # Ask every worker to exit after its current slice, then reap them
+            for slot in range(len(self.processes)):
+                self._active[slot] = 0
+
+            deadline = time.monotonic() + timeout
+            for process in self.processes:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+            self.processes = []
+        log_event(log, 'cpu_load_stopped')
+
+
+def _map_region(size):
+    """
+    Private anonymous mapping that forked processes don't inherit
+
+    MAP_PRIVATE rather than mmap's default MAP_SHARED, so pages are plain anonymous
+    memory that MADV_DONTNEED really frees (shared pages would stay in shmem), and
+    MADV_DONTFORK so CPU workers forked while the region exists never pin it.
+    """
+    region = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE)
+    region.madvise(mmap.MADV_DONTFORK)
+    return region
+
+
+def _touch_pages(region, start, end, value=1):
+    """Write one byte to every page in [start, end) so the kernel has to back it with real memory"""
+    for offset in range(start, end, mmap.PAGESIZE):
+        region[offset] = value
+
+
+class MemoryLoader:
+    # Anonymous mappings are created in regions of this size and filled in steps of STEP_BYTES
+    REGION_BYTES = 8 * 1024 * 1024
+    STEP_BYTES = 1024 * 1024
+
+    def __init__(self, target_bytes=None, target_percent=60, ramp_rate=None, retouch_interval=None,
+                 safety_percent=90, basis='limit'):
+        """
+        Initialize a memory loader that holds an exact amount of resident memory
+
+        Memory comes from anonymous mmap regions with every page written, so it
+        counts towards RSS and the container working set straight away. Shrinking
+        hands pages back with madvise(MADV_DONTNEED) and stopping unmaps the
+        regions, so freed memory returns to the OS immediately rather than
+        whenever the garbage collector and allocator get round to it.
+
+        Args:
+            target_bytes: Amount of memory to allocate (overrides target_percent)
+            target_percent: Target working set as a percentage of the pod's memory limit (or request, see basis)
+            ramp_rate: Maximum speed to grow or shrink at (MB/s); None = as fast as possible
+            retouch_interval: Rewrite every page this often (seconds, at least 1) to keep them hot; None = never
+            safety_percent: Stop growing once the pod's working set reaches this percentage of its limit
+            basis: Whether target_percent is relative to the pod's memory 'limit' or its 'request'
+        """
+        if target_bytes is None:
+            target_percent = self._to_limit_percent(target_percent, basis)
+        else:
+            _check_range('target_bytes', target_bytes)
+        if ramp_rate is not None:
+            _check_range('ramp_rate', ramp_rate)
+        if retouch_interval is not None:
+            # Shorter intervals would spend the loader's whole time rewriting pages
+            _check_range('retouch_interval', retouch_interval, low=1.0)
+        self.target_percent = target_percent if target_bytes is None else None
+        self.ramp_rate = ramp_rate
+        self.retouch_interval = retouch_interval
+        self.safety_percent = safety_percent
+        self.running = False
+        self.allocated_bytes = 0
+        self.target_bytes = self._page_align(target_bytes) if target_bytes is not None else None
+        self._regions = []  # [mmap, bytes in use] pairs; only the last region is ever partly used
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._touch_value = 1
+
+    @staticmethod
+    def _page_align(size):
+        return max(0, int(size) + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+    def _bytes_for_percent(self, target_percent):
+        """Bytes to hold so the whole pod's working set sits at target_percent of its limit"""
+        baseline = pod_stats.memory_usage() - self.allocated_bytes
+        return self._page_align(max(0, pod_stats.memory_limit() * target_percent / 100 - baseline))
+
+    @staticmethod
+    def _to_limit_percent(target_percent, basis):
+        return _limit_percent('target_percent', target_percent, basis, pod_stats.memory_request(),
+                              pod_stats.memory_limit())
+
+    def resize(self, target_bytes=None, target_percent=None, basis='limit'):
+        """
+        Grow or shrink the held memory to a new level without releasing the rest
+
+        Args:
+            target_bytes: New amount of memory to hold
+            target_percent: New target as a percentage of the pod's memory limit or request
+                            (used if target_bytes is None)
+            basis: Whether target_percent is relative to the pod's memory 'limit' or its 'request'
+        """
+        if target_bytes is None:
+            target_percent = self._to_limit_percent(target_percent, basis)
+        else:
+            _check_range('target_bytes', target_bytes)
+        with self._lock:
+            if target_bytes is None:
+                self.target_percent = target_percent
+                self.target_bytes = self._bytes_for_percent(target_percent)
+            else:
+                self.target_percent = None
+                self.target_bytes = self._page_align(target_bytes)
+        self._wake.set()
+
+    def _grow(self, size):
+        if not self._regions or self._regions[-1][1] == len(self._regions[-1][0]):
+            region_size = min(self.REGION_BYTES, self._page_align(self.target_bytes - self.allocated_bytes))
+            self._regions.append([_map_region(region_size), 0])
+        region = self._regions[-1]
+        size = min(size, len(region[0]) - region[1])
+        _touch_pages(region[0], region[1], region[1] + size, self._touch_value)
+        region[1] += size
+        self.allocated_bytes += size
+        return size
+
+    def _shrink(self, size):
+        region = self._regions[-1]
+        size = min(size, region[1])
+        region[1] -= size
+        self.allocated_bytes -= size
+        if region[1] == 0:
+            region[0].close()  # munmap
+            self._regions.pop()
+        else:
+            # Give the tail pages back to the OS but keep the mapping for the pages still in use
+            region[0].madvise(mmap.MADV_DONTNEED, region[1], size)
+        return size
+
+    def _retouch(self):
+        """Rewrite every held page so it stays in the active working set"""
+        self._touch_value = self._touch_value % 255 + 1
+        for region, used in self._regions:
+            _touch_pages(region, 0, used, self._touch_value)
+
+    def _run(self):
+        """Moves the held memory towards the target and keeps it there until stopped"""
+        last_retouch = time.monotonic()
+        while self.running:
+            wait = 1.0 if self.retouch_interval is None else self.retouch_interval
+            with self._lock:
+                if not self.running:
+                    break
+                difference = self.target_bytes - self.allocated_bytes
+                if difference > 0 and pod_stats.memory_percent() >= self.safety_percent:
+                    log_event(log, 'memory_safety_limit', logging.WARNING, safety_percent=self.safety_percent,
+                              allocated_bytes=self.allocated_bytes)
+                    self.target_bytes = self.allocated_bytes
+                elif difference > 0:
+                    step = self._grow(min(self.STEP_BYTES, difference))
+                    wait = step / (self.ramp_rate * 1024 ** 2) if self.ramp_rate else 0
+                elif difference < 0:
+                    step = self._shrink(min(self.STEP_BYTES, -difference))
+                    wait = step / (self.ramp_rate * 1024 ** 2) if self.ramp_rate else 0
+                elif self.retouch_interval is not None and time.monotonic() - last_retouch >= self.retouch_interval:
+                    self._retouch()
+                    last_retouch = time.monotonic()
+            if wait:
+                self._wake.wait(wait)
+                self._wake.clear()
+
+    def start(self):
+        """Start allocating towards the target in a background thread"""
+        with self._lock:
+            if self.running:
+                log_event(log, 'memory_load_already_running', logging.WARNING)
+                return
+            if self.target_bytes is None:
+                self.target_bytes = self._bytes_for_percent(self.target_percent)
+            self.running = True
+
+        log_event(log, 'memory_load_started', target_bytes=self.target_bytes, ramp_rate=self.ramp_rate,
+                  retouch_interval=self.retouch_interval)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the memory load test and unmap everything it holds"""
+        with self._lock:
+            if not self.running and not self._regions:
+                return
+            self.running = False
+            freed = self.allocated_bytes
+            for region, _ in self._regions:
+                region.close()  # munmap
+            self._regions = []
+            self.allocated_bytes = 0
+        self._wake.set()
+        log_event(log, 'memory_load_stopped', freed_bytes=freed)
+
+    def state(self):
+        """Snapshot of the loader's progress"""
+        return {
+            'target_bytes': self.target_bytes,
+            'target_percent': self.target_percent,
+            'allocated_bytes': self.allocated_bytes,
+            'regions': len(self._regions),
+            'ramp_rate': self.ramp_rate,
+            'retouch_interval': self.retouch_interval,
+        }
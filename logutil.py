@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Periodic events (marked rate_limit=True) are logged at most once per this many seconds each
+LOG_RATE_LIMIT = float(os.environ.get('LOG_RATE_LIMIT', 10))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+
+class JsonFormatter(logging.Formatter):
+    """Render each record as one JSON object per line: time, level, logger, event and fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=LOG_RATE_LIMIT):
+        """
+        Drop repeats of rate-limited events that arrive within `interval` seconds
+
+        The next record that gets through carries a count of how many were dropped.
+        """
+        super().__init__()
+        self.interval = interval
+        self._last = {}  # (logger, event) -> [last emitted time, suppressed count]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'rate_limit', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._last.setdefault(key, [-self.interval, 0])
+            if now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            record.suppressed = state[1]
+            state[0], state[1] = now, 0
+        return True
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def get_logger(name):
+    """Logger under the shared "loadgen" hierarchy, writing JSON lines to stdout"""
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            root = logging.getLogger('loadgen')
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(JsonFormatter())
+            handler.addFilter(RateLimitFilter())
+            root.addHandler(handler)
+            root.setLevel(LOG_LEVEL)
+            root.propagate = False
+            _configured = True
+    return logging.getLogger(f'loadgen.{name}')
+
+
+def log_event(logger, event, level=logging.INFO, rate_limit=False, **fields):
+    """
+    Log a structured event
+
+    Args:
+        logger: Logger from get_logger()
+        event: Short event name; also the rate-limit key
+        level: Logging level
+        rate_limit: Subject this event to the per-event rate limit (for anything logged periodically)
+        fields: Extra key/value pairs included in the JSON record
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields, 'rate_limit': rate_limit})
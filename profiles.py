@@ -0,0 +1,314 @@
+import json
+import math
+import threading
+import time
+
+from logutil import get_logger, log_event
+
+log = get_logger('profiles')
+
+# Setpoints a timeline can drive, each a percentage of the pod's limit
+CHANNELS = ('cpu', 'memory')
+
+# Allowed seconds between setpoint updates; shorter ticks would spin on the control lock
+MIN_TICK = 0.05
+MAX_TICK = 60.0
+
+# Keys accepted for each channel when reading recorded traces
+_TRACE_KEYS = {
+    'cpu': ('cpu', 'cpu_percent'),
+    'memory': ('memory', 'memory_percent'),
+}
+_TRACE_TIME_KEYS = ('t', 'ts', 'time', 'timestamp')
+
+
+def _number(value, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{what} must be a number, got {value!r}")
+    return float(value)
+
+
+class Segment:
+    def __init__(self, kind, duration, channels):
+        """
+        One piece of a load timeline
+
+        Args:
+            kind: constant, ramp, step, sine or burst
+            duration: Length of the segment (seconds)
+            channels: {channel: spec}; the spec's shape depends on the kind:
+                constant  50
+                ramp      [from, to]
+                step      [level, level, ...] held for equal parts of the segment
+                sine      {"mean", "amplitude", "period", "phase" (fraction of a period, optional)}
+                burst     {"base", "peak", "period", "width"} - peak for `width` seconds every `period`
+        """
+        self.kind = kind
+        self.duration = duration
+        self.channels = channels
+
+    @classmethod
+    def from_dict(cls, data, index=0):
+        what = f"segment {index}"
+        if not isinstance(data, dict):
+            raise ValueError(f"{what} must be an object")
+        kind = data.get('type', 'constant')
+        if kind not in _SHAPES:
+            raise ValueError(f"{what} has unknown type '{kind}', expected one of: {', '.join(_SHAPES)}")
+        duration = _number(data.get('duration'), f"{what} duration")
+        if duration <= 0:
+            raise ValueError(f"{what} duration must be positive")
+        channels = {name: _SHAPES[kind][0](data[name], f"{what} {name}") for name in CHANNELS if name in data}
+        if not channels:
+            raise ValueError(f"{what} sets none of: {', '.join(CHANNELS)}")
+        return cls(kind, duration, channels)
+
+    def value(self, channel, elapsed):
+        """Setpoint for a channel `elapsed` seconds into the segment, or None if the segment leaves it alone"""
+        spec = self.channels.get(channel)
+        if spec is None:
+            return None
+        return _SHAPES[self.kind][1](spec, min(max(elapsed, 0.0), self.duration), self.duration)
+
+    def as_dict(self):
+        return {'type': self.kind, 'duration': self.duration, **self.channels}
+
+
+def _parse_constant(spec, what):
+    return _number(spec, what)
+
+
+def _parse_pair(spec, what):
+    if not isinstance(spec, list) or len(spec) != 2:
+        raise ValueError(f"{what} must be [from, to]")
+    return [_number(v, what) for v in spec]
+
+
+def _parse_levels(spec, what):
+    if not isinstance(spec, list) or not spec:
+        raise ValueError(f"{what} must be a non-empty list of levels")
+    return [_number(v, what) for v in spec]
+
+
+def _parse_fields(*required, **optional):
+    def parse(spec, what):
+        if not isinstance(spec, dict):
+            raise ValueError(f"{what} must be an object with {', '.join(required)}")
+        missing = [k for k in required if k not in spec]
+        if missing:
+            raise ValueError(f"{what} is missing {', '.join(missing)}")
+        parsed = {k: _number(spec[k], f"{what} {k}") for k in required}
+        parsed.update({k: _number(spec.get(k, default), f"{what} {k}") for k, default in optional.items()})
+        if parsed.get('period', 1) <= 0:
+            raise ValueError(f"{what} period must be positive")
+        return parsed
+    return parse
+
+
+def _step(levels, elapsed, duration):
+    return levels[min(len(levels) - 1, int(elapsed / duration * len(levels)))]
+
+
+def _sine(spec, elapsed, duration):
+    angle = 2 * math.pi * (elapsed / spec['period'] + spec['phase'])
+    return spec['mean'] + spec['amplitude'] * math.sin(angle)
+
+
+def _burst(spec, elapsed, duration):
+    return spec['peak'] if elapsed % spec['period'] < spec['width'] else spec['base']
+
+
+# kind -> (spec parser, value at (spec, elapsed, duration))
+_SHAPES = {
+    'constant': (_parse_constant, lambda spec, elapsed, duration: spec),
+    'ramp': (_parse_pair, lambda spec, elapsed, duration: spec[0] + (spec[1] - spec[0]) * elapsed / duration),
+    'step': (_parse_levels, _step),
+    'sine': (_parse_fields('mean', 'amplitude', 'period', phase=0), _sine),
+    'burst': (_parse_fields('base', 'peak', 'period', 'width'), _burst),
+}
+
+
+def parse_timeline(data):
+    """Build a list of Segments from a {"segments": [...]} document or a bare list"""
+    segments = data.get('segments') if isinstance(data, dict) else data
+    if not isinstance(segments, list) or not segments:
+        raise ValueError("A profile needs a non-empty list of segments")
+    return [Segment.from_dict(segment, i) for i, segment in enumerate(segments)]
+
+
+def _trace_from_points(points):
+    """Turn [(t, {channel: value})] into ramp segments between consecutive points"""
+    points = [(_number(t, f"trace point {i + 1} time"),
+               {name: _number(value, f"trace point {i + 1} {name}") for name, value in values.items()
+                if value is not None})
+              for i, (t, values) in enumerate(points)]
+    points.sort(key=lambda p: p[0])
+    segments = []
+    for (t0, start), (t1, end) in zip(points, points[1:]):
+        if t1 <= t0:
+            continue
+        channels = {name: [start[name], end[name]] for name in CHANNELS
+                    if start.get(name) is not None and end.get(name) is not None}
+        if channels:
+            segments.append(Segment('ramp', t1 - t0, channels))
+    if not segments:
+        raise ValueError("A trace needs at least two timestamped points with cpu or memory values")
+    return segments
+
+
+def parse_trace(payload):
+    """
+    Build ramp segments from a recorded utilization trace
+
+    Accepts either a /history response ({"timestamps": [...], "series": {"cpu_percent": [...], ...}})
+    or JSON Lines text with one {"timestamp": ..., "cpu_percent": ..., "memory_percent": ...}
+    object per line (t/ts/time and cpu/memory are accepted as key aliases too).
+    """
+    if isinstance(payload, (bytes, str)):
+        text = payload.decode() if isinstance(payload, bytes) else payload
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            try:
+                payload = [json.loads(line) for line in text.splitlines() if line.strip()]
+            except ValueError as e:
+                raise ValueError(f"Trace is neither JSON nor JSON Lines: {e}")
+
+    if isinstance(payload, dict) and 'timestamps' in payload:
+        series = payload.get('series', {})
+        columns = {name: next((series[k] for k in keys if k in series), None) for name, keys in _TRACE_KEYS.items()}
+        points = [(t, {name: column[i] for name, column in columns.items() if column is not None})
+                  for i, t in enumerate(payload['timestamps'])]
+    elif isinstance(payload, list):
+        points = []
+        for i, record in enumerate(payload):
+            if not isinstance(record, dict):
+                raise ValueError(f"Trace line {i + 1} is not an object")
+            t = next((record[k] for k in _TRACE_TIME_KEYS if k in record), None)
+            if t is None:
+                continue
+            points.append((t, {name: next((record[k] for k in keys if k in record), None)
+                               for name, keys in _TRACE_KEYS.items()}))
+    else:
+        raise ValueError("Unrecognised trace format")
+    return _trace_from_points(points)
+
+
+class ProfileScheduler:
+    def __init__(self, segments, apply, on_finish=None, tick=0.5, speed=1.0, loop=False):
+        """
+        Play a timeline of segments, pushing interpolated setpoints at a fixed tick
+
+        Args:
+            segments: Segments to play in order
+            apply: Called with {channel: setpoint} each tick (only channels the current segment drives)
+            on_finish: Called once when the timeline ends or is aborted
+            tick: Seconds between setpoint updates (MIN_TICK to MAX_TICK)
+            speed: Timeline seconds played per wall-clock second (e.g. 60 plays an hour in a minute)
+            loop: Restart from the first segment when the timeline ends
+        """
+        if not MIN_TICK <= _number(tick, "tick") <= MAX_TICK:
+            raise ValueError(f"tick must be between {MIN_TICK:g} and {MAX_TICK:g} seconds")
+        if _number(speed, "speed") <= 0:
+            raise ValueError("speed must be positive")
+        self.segments = segments
+        self.apply = apply
+        self.on_finish = on_finish
+        self.tick = tick
+        self.speed = speed
+        self.loop = loop
+        self.duration = sum(segment.duration for segment in segments)
+        self.running = False
+        self.paused = False
+        self.elapsed = 0.0  # Timeline seconds played in the current pass
+        self.loops = 0
+        self.setpoints = {}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def position(self, elapsed):
+        """(segment index, seconds into that segment) for a point on the timeline"""
+        for index, segment in enumerate(self.segments):
+            if elapsed < segment.duration:
+                return index, elapsed
+            elapsed -= segment.duration
+        return len(self.segments) - 1, self.segments[-1].duration
+
+    def setpoints_at(self, elapsed):
+        index, offset = self.position(elapsed)
+        segment = self.segments[index]
+        values = {name: segment.value(name, offset) for name in CHANNELS}
+        return {name: value for name, value in values.items() if value is not None}
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                if not self.paused:
+                    self.elapsed += (now - last) * self.speed
+                    if self.elapsed >= self.duration:
+                        if not self.loop:
+                            self.elapsed = self.duration
+                            self._push()
+                            break
+                        self.loops += 1
+                        self.elapsed %= self.duration
+                    self._push()
+            last = now
+            self._stop.wait(self.tick)
+
+        with self._lock:
+            self.running = False
+        log_event(log, 'profile_finished', elapsed=round(self.elapsed, 3), loops=self.loops,
+                  aborted=self._stop.is_set())
+        if self.on_finish:
+            self.on_finish()
+
+    def _push(self):
+        self.setpoints = self.setpoints_at(self.elapsed)
+        try:
+            self.apply(self.setpoints)
+        except Exception:
+            log.exception('profile_apply_failed')
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._push()
+        log_event(log, 'profile_started', segments=len(self.segments), duration=self.duration,
+                  speed=self.speed, loop=self.loop)
+        self._thread = threading.Thread(target=self._run, name="profile-scheduler", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+
+    def resume(self):
+        with self._lock:
+            self.paused = False
+
+    def abort(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.tick * 2 + 1)
+
+    def state(self):
+        index, offset = self.position(self.elapsed)
+        return {
+            'running': self.running,
+            'paused': self.paused,
+            'elapsed': self.elapsed,
+            'duration': self.duration,
+            'segments': len(self.segments),
+            'segment': index,
+            'segment_elapsed': offset,
+            'loops': self.loops,
+            'loop': self.loop,
+            'speed': self.speed,
+            'setpoints': self.setpoints,
+        }
@@ -0,0 +1,147 @@
+import math
+import threading
+import time
+from array import array
+
+from logutil import get_logger
+
+log = get_logger('sampler')
+
+
+class RingBuffer:
+    def __init__(self, fields, capacity):
+        """
+        Fixed-size time series store with one preallocated float array per field
+
+        Appending overwrites the oldest sample once the buffer is full, so memory
+        use is constant and no per-sample objects are kept around. Missing values
+        are stored as NaN.
+
+        Args:
+            fields: Field names; the first one must be the timestamp
+            capacity: Number of samples to keep
+        """
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.count = 0
+        self._columns = [array('d', [math.nan]) * capacity for _ in self.fields]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def append(self, values):
+        with self._lock:
+            for column, value in zip(self._columns, values):
+                column[self._next] = math.nan if value is None else value
+            self._next = (self._next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        """The most recent sample as a {field: value} dict, or None if empty"""
+        with self._lock:
+            if not self.count:
+                return None
+            index = (self._next - 1) % self.capacity
+            return {field: _json_value(column[index]) for field, column in zip(self.fields, self._columns)}
+
+    def window(self, since=None, until=None, fields=None):
+        """
+        Samples with since <= timestamp <= until, oldest first
+
+        Returns:
+            {field: [values]} for the timestamp field plus each requested field
+        """
+        wanted = [self.fields[0]] + [f for f in (fields or self.fields[1:]) if f != self.fields[0]]
+        unknown = set(wanted) - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+
+        with self._lock:
+            start = (self._next - self.count) % self.capacity
+            indices = [(start + i) % self.capacity for i in range(self.count)]
+            timestamps = self._columns[0]
+            indices = [i for i in indices
+                       if (since is None or timestamps[i] >= since) and (until is None or timestamps[i] <= until)]
+            columns = [self._columns[self.fields.index(f)] for f in wanted]
+            return {field: [_json_value(column[i]) for i in indices] for field, column in zip(wanted, columns)}
+
+
+def _json_value(value):
+    return None if math.isnan(value) else value
+
+
+def aggregate(values):
+    """min/max/avg/p95 of a series, ignoring missing values"""
+    present = sorted(v for v in values if v is not None)
+    if not present:
+        return {'min': None, 'max': None, 'avg': None, 'p95': None}
+    return {
+        'min': present[0],
+        'max': present[-1],
+        'avg': sum(present) / len(present),
+        # Nearest-rank percentile
+        'p95': present[max(0, math.ceil(0.95 * len(present)) - 1)],
+    }
+
+
+class Sampler:
+    def __init__(self, collect, fields, interval=0.5, capacity=3600):
+        """
+        Background thread that records a fixed set of metrics at a fixed rate
+
+        Args:
+            collect: Callable returning one value per field (None for missing)
+            fields: Names of the values collect() returns
+            interval: Seconds between samples
+            capacity: Number of samples kept (capacity * interval seconds of history)
+        """
+        self.collect = collect
+        self.interval = interval
+        self.buffer = RingBuffer(('timestamp',) + tuple(fields), capacity)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def fields(self):
+        return self.buffer.fields
+
+    def sample(self):
+        """Take one sample now"""
+        try:
+            values = self.collect()
+        except Exception:
+            log.exception('sample_failed')
+            return
+        self.buffer.append((time.time(),) + tuple(values))
+
+    def _run(self):
+        next_sample = time.monotonic() + self.interval
+        while not self._stop.wait(max(0.0, next_sample - time.monotonic())):
+            self.sample()
+            next_sample += self.interval
+            if next_sample < time.monotonic():
+                # Skip missed ticks rather than sampling in a burst
+                next_sample = time.monotonic() + self.interval
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def history(self, since=None, until=None, fields=None):
+        """Windowed time series with per-field aggregates"""
+        series = self.buffer.window(since, until, fields)
+        timestamps = series.pop('timestamp')
+        return {
+            'timestamps': timestamps,
+            'series': series,
+            'aggregates': {field: aggregate(values) for field, values in series.items()},
+        }
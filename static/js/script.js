@@ -71,46 +71,55 @@
             });
         }
 
+        // Latest full status; stream events only carry the fields that changed
+        let currentStatus = {};
+        let pollTimer = null;
+
+        function renderStatus(data) {
+            // Update CPU display
+            const cpuPercent = data.cpu_percent.toFixed(1);
+            document.getElementById('cpu-value').innerText = cpuPercent + '%';
+            document.getElementById('cpu-bar').style.width = cpuPercent + '%';
+
+            // Change color if approaching danger zone
+            if (cpuPercent > 80) {
+                document.getElementById('cpu-bar').style.backgroundColor = '#dc3545';
+            } else {
+                document.getElementById('cpu-bar').style.backgroundColor = '#0062cc';
+            }
+
+            // Update Memory display
+            const memoryPercent = data.memory_percent.toFixed(1);
+            document.getElementById('memory-value').innerText = memoryPercent + '%';
+            document.getElementById('memory-bar').style.width = memoryPercent + '%';
+
+            // Change color if approaching danger zone
+            if (memoryPercent > 80) {
+                document.getElementById('memory-bar').style.backgroundColor = '#dc3545';
+            } else {
+                document.getElementById('memory-bar').style.backgroundColor = '#28a745';
+            }
+
+            // Update test status
+            document.getElementById('cpu-test-status').innerText = data.cpu_test_running ? 'Running' : 'Stopped';
+            document.getElementById('cpu-test-status').style.color = data.cpu_test_running ? '#28a745' : '#dc3545';
+
+            document.getElementById('memory-test-status').innerText = data.memory_test_running ? 'Running' : 'Stopped';
+            document.getElementById('memory-test-status').style.color = data.memory_test_running ? '#28a745' : '#dc3545';
+
+            // Warning if memory is getting high
+            if (memoryPercent > 85 && (data.cpu_test_running || data.memory_test_running)) {
+                document.getElementById('message').innerHTML =
+                    "<span class='attention'>WARNING: Memory usage is very high! Consider stopping tests to prevent pod crash.</span>";
+            }
+        }
+
         function updateStatus() {
             fetch('/status')
                 .then(response => response.json())
                 .then(data => {
-                    // Update CPU display
-                    const cpuPercent = data.cpu_percent.toFixed(1);
-                    document.getElementById('cpu-value').innerText = cpuPercent + '%';
-                    document.getElementById('cpu-bar').style.width = cpuPercent + '%';
-
-                    // Change color if approaching danger zone
-                    if (cpuPercent > 80) {
-                        document.getElementById('cpu-bar').style.backgroundColor = '#dc3545';
-                    } else {
-                        document.getElementById('cpu-bar').style.backgroundColor = '#0062cc';
-                    }
-
-                    // Update Memory display
-                    const memoryPercent = data.memory_percent.toFixed(1);
-                    document.getElementById('memory-value').innerText = memoryPercent + '%';
-                    document.getElementById('memory-bar').style.width = memoryPercent + '%';
-
-                    // Change color if approaching danger zone
-                    if (memoryPercent > 80) {
-                        document.getElementById('memory-bar').style.backgroundColor = '#dc3545';
-                    } else {
-                        document.getElementById('memory-bar').style.backgroundColor = '#28a745';
-                    }
-
-                    // Update test status
-                    document.getElementById('cpu-test-status').innerText = data.cpu_test_running ? 'Running' : 'Stopped';
-                    document.getElementById('cpu-test-status').style.color = data.cpu_test_running ? '#28a745' : '#dc3545';
-
-                    document.getElementById('memory-test-status').innerText = data.memory_test_running ? 'Running' : 'Stopped';
-                    document.getElementById('memory-test-status').style.color = data.memory_test_running ? '#28a745' : '#dc3545';
-
-                    // Warning if memory is getting high
-                    if (memoryPercent > 85 && (data.cpu_test_running || data.memory_test_running)) {
-                        document.getElementById('message').innerHTML =
-                            "<span class='attention'>WARNING: Memory usage is very high! Consider stopping tests to prevent pod crash.</span>";
-                    }
+                    currentStatus = data;
+                    renderStatus(data);
                 })
                 .catch(error => {
                     console.error("Error fetching status:", error);
@@ -118,8 +127,39 @@
                 });
         }
 
-        // Update status every 2 seconds
-        setInterval(updateStatus, 2000);
+        function startPolling() {
+            if (pollTimer === null) {
+                // Update status every 2 seconds
+                pollTimer = setInterval(updateStatus, 2000);
+            }
+        }
+
+        function startStatusStream() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+
+            const source = new EventSource('/status/stream');
+            let received = false;
+
+            source.onmessage = event => {
+                received = true;
+                currentStatus = Object.assign(currentStatus, JSON.parse(event.data));
+                renderStatus(currentStatus);
+            };
+
+            source.onerror = () => {
+                // Never connected (e.g. a proxy that buffers responses), or turned away because the
+                // server has too many streams open: fall back to polling for good
+                if (!received || source.readyState === EventSource.CLOSED) {
+                    source.close();
+                    startPolling();
+                }
+                // Otherwise the browser reconnects by itself
+            };
+        }
 
-        // Initial status update
+        // Initial status update, then live updates from the stream
         updateStatus();
+        startStatusStream();
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+from logutil import get_logger
+
+log = get_logger('stream')
+
+
+class Subscription:
+    def __init__(self, interval):
+        """
+        One subscriber's mailbox; holds only the newest frame so slow readers skip frames instead of queueing them
+
+        Args:
+            interval: Minimum seconds between frames delivered to this subscriber
+        """
+        self.interval = interval
+        self.dropped = 0
+        self._frame = None
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def offer(self, frame):
+        with self._ready:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._ready.notify()
+
+    def next(self, timeout):
+        """Wait up to `timeout` seconds for a frame; returns None on timeout or once closed"""
+        with self._ready:
+            if self._frame is None and not self._closed:
+                self._ready.wait(timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class Broadcaster:
+    def __init__(self, produce, interval=0.25, max_subscribers=None):
+        """
+        Fan one producer out to many subscribers
+
+        The producer thread only runs while someone is subscribed, and calls
+        produce() once per interval however many subscribers there are.
+
+        Args:
+            produce: Callable returning the next frame (a dict)
+            interval: Seconds between produced frames (the fastest rate any subscriber gets)
+            max_subscribers: Subscribers to accept at once; None = no limit
+        """
+        self.produce = produce
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self, interval=None):
+        """Add a subscriber; returns its Subscription, or None if max_subscribers are already connected"""
+        subscription = Subscription(max(self.interval, interval or 0))
+        with self._lock:
+            if self.max_subscribers is not None and len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="status-broadcaster", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self):
+        next_frame = time.monotonic()
+        while True:
+            with self._lock:
+                subscribers = list(self._subscribers)
+                if not subscribers:
+                    self._thread = None
+                    return
+            try:
+                frame = self.produce()
+            except Exception:
+                log.exception('frame_failed')
+            else:
+                for subscription in subscribers:
+                    subscription.offer(frame)
+            next_frame += self.interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    def events(self, subscription, heartbeat=15.0):
+        """
+        Server-Sent Events for one subscriber
+
+        The first event carries the full frame; later ones only the fields that
+        changed. A comment line is sent when nothing has changed for `heartbeat`
+        seconds so proxies keep the connection open.
+        """
+        sent = {}
+        last_event = time.monotonic()
+        try:
+            while not subscription.closed:
+                started = time.monotonic()
+                frame = subscription.next(timeout=heartbeat)
+                if frame is not None:
+                    changes = {key: value for key, value in frame.items() if sent.get(key, _MISSING) != value}
+                    if changes:
+                        sent.update(changes)
+                        last_event = time.monotonic()
+                        yield f"data: {json.dumps(changes)}\n\n"
+                if time.monotonic() - last_event >= heartbeat:
+                    last_event = time.monotonic()
+                    yield ": keep-alive\n\n"
+                # Hold back to this subscriber's own frame rate; frames produced meanwhile are dropped
+                time.sleep(max(0.0, subscription.interval - (time.monotonic() - started)))
+        finally:
+            self.unsubscribe(subscription)
+
+
+_MISSING = object()
@@ -0,0 +1,117 @@
+import psutil
+import pytest
+
+import cgroup
+from cgroup import CgroupStats
+
+MiB = 1024 ** 2
+
+
+def _write_tree(root, files):
+    for relative, content in files.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return str(root)
+
+
+@pytest.fixture(autouse=True)
+def four_cores(monkeypatch):
+    # Limits are capped at the usable core count, so pin it above every limit used here
+    monkeypatch.setattr(cgroup, '_allowed_cpu_count', lambda: 4)
+    # Requests from the Downward API would mask the cgroup files under test
+    monkeypatch.delenv(cgroup.CPU_REQUEST_ENV, raising=False)
+    monkeypatch.delenv(cgroup.MEMORY_REQUEST_ENV, raising=False)
+
+
+def test_v2(tmp_path):
+    stats = CgroupStats(_write_tree(tmp_path, {
+        'cgroup.controllers': 'cpu memory',
+        'cpu.max': '25000 100000',
+        'cpu.weight': '10',
+        'cpu.stat': 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000',
+        'memory.max': str(256 * MiB),
+        'memory.current': str(100 * MiB),
+        'memory.stat': f'anon {80 * MiB}\nfile {20 * MiB}\ninactive_file {15 * MiB}',
+    }))
+
+    assert stats.version == 2
+    assert stats.cpu_limit() == 0.25
+    # A 250m request becomes cpu.shares 256, which maps (rounding down) to cpu.weight 10
+    assert stats.cpu_request() == pytest.approx(0.25, abs=0.02)
+    assert stats.cpu_usage() == 2.5
+    assert stats.memory_limit() == 256 * MiB
+    assert stats.memory_usage() == 85 * MiB
+    assert stats.memory_request() is None
+
+
+def test_requests_from_downward_api(tmp_path, monkeypatch):
+    # deployment.yaml's 100m request is written as cpu.weight 4, which only maps back to 79m
+    stats = CgroupStats(_write_tree(tmp_path, {'cgroup.controllers': 'cpu memory', 'cpu.weight': '4'}))
+    assert stats.cpu_request() == pytest.approx(0.079, abs=0.001)
+
+    monkeypatch.setenv(cgroup.CPU_REQUEST_ENV, '100')
+    monkeypatch.setenv(cgroup.MEMORY_REQUEST_ENV, str(128 * MiB))
+    assert stats.cpu_request() == 0.1
+    assert stats.memory_request() == 128 * MiB
+
+    # Unset or invalid values fall back as if the variables weren't there
+    monkeypatch.setenv(cgroup.CPU_REQUEST_ENV, 'nan')
+    monkeypatch.setenv(cgroup.MEMORY_REQUEST_ENV, '0')
+    assert stats.cpu_request() == pytest.approx(0.079, abs=0.001)
+    assert stats.memory_request() is None
+
+
+def test_v2_unlimited(tmp_path):
+    stats = CgroupStats(_write_tree(tmp_path, {
+        'cgroup.controllers': 'cpu memory',
+        'cpu.max': 'max 100000',
+        'memory.max': 'max',
+    }))
+
+    assert stats.cpu_limit() == 4
+    assert stats.memory_limit() == psutil.virtual_memory().total
+
+
+def test_v1_co_mounted(tmp_path):
+    stats = CgroupStats(_write_tree(tmp_path, {
+        'cpu,cpuacct/cpu.cfs_quota_us': '50000',
+        'cpu,cpuacct/cpu.cfs_period_us': '100000',
+        'cpu,cpuacct/cpu.shares': '512',
+        'cpu,cpuacct/cpuacct.usage': '3000000000',
+        'memory/memory.limit_in_bytes': str(128 * MiB),
+        'memory/memory.usage_in_bytes': str(64 * MiB),
+        'memory/memory.stat': f'cache {10 * MiB}\ntotal_inactive_file {4 * MiB}',
+    }))
+
+    assert stats.version == 1
+    assert stats.cpu_limit() == 0.5
+    assert stats.cpu_request() == 0.5
+    assert stats.cpu_usage() == 3.0
+    assert stats.memory_limit() == 128 * MiB
+    assert stats.memory_usage() == 60 * MiB
+
+
+def test_v1_unlimited(tmp_path):
+    stats = CgroupStats(_write_tree(tmp_path, {
+        'cpuacct/cpuacct.usage': '0',
+        'cpu/cpu.cfs_quota_us': '-1',
+        'cpu/cpu.cfs_period_us': '100000',
+        'memory/memory.limit_in_bytes': str(cgroup._V1_UNLIMITED),
+    }))
+
+    assert stats.version == 1
+    assert stats.cpu_limit() == 4
+    assert stats.memory_limit() == psutil.virtual_memory().total
+
+
+def test_no_cgroup(tmp_path):
+    stats = CgroupStats(str(tmp_path))
+
+    assert stats.version is None
+    assert not stats.in_container
+    assert stats.cpu_limit() == 4
+    assert stats.cpu_request() is None
+    assert stats.cpu_usage() > 0
+    assert stats.memory_limit() == psutil.virtual_memory().total
+    assert 0 < stats.memory_usage() <= stats.memory_limit()
@@ -0,0 +1,85 @@
+import pytest
+
+from controller import PIDController, StepResponse
+
+
+def _record(response, samples):
+    for t, value in samples:
+        response.record(value, now=response.started_at + t)
+
+
+def test_settles_only_after_holding_inside_the_band():
+    response = StepResponse(60, 0, band=2, hold=2)
+    _record(response, [(0.5, 30), (1.0, 59)])
+    assert not response.settled
+    assert response.settling_time is None
+    assert response.steady_state_error is None
+
+    _record(response, [(2.0, 61), (3.0, 60)])
+    assert response.settled
+    assert response.settling_time == 1.0
+    assert response.steady_state_error == pytest.approx(0.0)
+
+
+def test_leaving_the_band_restarts_the_hold():
+    response = StepResponse(60, 0, band=2, hold=2)
+    _record(response, [(1.0, 60), (2.5, 60), (3.0, 65)])
+    assert not response.settled
+
+    _record(response, [(4.0, 59), (5.0, 59), (6.0, 59)])
+    assert response.settling_time == 4.0
+    # Only the samples since the signal last entered the band count
+    assert response.steady_state_error == pytest.approx(1.0)
+
+
+def test_overshoot_follows_the_step_direction():
+    up = StepResponse(60, 10, band=2)
+    _record(up, [(1.0, 70), (2.0, 55), (3.0, 60)])
+    assert up.overshoot == 10
+
+    down = StepResponse(20, 60, band=2)
+    _record(down, [(1.0, 15), (2.0, 25)])
+    assert down.overshoot == 5
+
+    # Undershooting the target is not overshoot
+    short = StepResponse(60, 10, band=2)
+    _record(short, [(1.0, 40), (2.0, 50)])
+    assert short.overshoot == 0
+
+
+def test_integral_accumulates_while_unsaturated():
+    controller = PIDController(kp=0.0, ki=1.0, setpoint=50, feedforward=False)
+    controller.update(40, dt=1.0)
+    controller.update(40, dt=1.0)
+    assert controller.integral == pytest.approx(20.0)
+    assert controller.output == pytest.approx(20.0)
+
+
+def test_integral_holds_while_saturated():
+    controller = PIDController(kp=0.0, ki=1.0, setpoint=90, output_max=100)
+    for _ in range(10):
+        # Feed-forward already puts the output at 90, so the first step of integral pushes it past the limit
+        assert controller.update(10, dt=1.0) == 100
+    assert controller.integral == 0.0
+
+    # With no wound-up integral the output comes off the limit on the first sample past the setpoint
+    assert controller.update(95, dt=1.0) < 100
+
+
+def test_integral_unwinds_towards_range_while_saturated():
+    controller = PIDController(kp=0.0, ki=1.0, setpoint=10, output_min=0, output_max=100)
+    controller.integral = 200.0
+    assert controller.update(20, dt=1.0) == 100
+    # Out of range, but the error pulls back towards it, so the integrator may move
+    assert controller.integral == pytest.approx(190.0)
+
+
+def test_setpoint_change_starts_a_new_step_response():
+    controller = PIDController(kp=0.1, ki=0.1, setpoint=30)
+    controller.reset(measurement=5)
+    assert controller.response.initial == 5
+
+    controller.update(30, dt=0.5)
+    controller.setpoint = 60
+    assert controller.response.setpoint == 60
+    assert controller.response.initial == 30
@@ -0,0 +1,25 @@
+import math
+
+import pytest
+
+from profiles import ProfileScheduler, parse_timeline
+
+SEGMENTS = parse_timeline([{'type': 'constant', 'duration': 10, 'cpu': 50}])
+
+
+@pytest.mark.parametrize('tick, speed', [
+    (0, 1), (1e-6, 1), (math.nan, 1), (math.inf, 1), (1e12, 1),
+    (0.5, 0), (0.5, -1), (0.5, math.nan), (0.5, math.inf),
+])
+def test_rejects_bad_tick_and_speed(tick, speed):
+    with pytest.raises(ValueError):
+        ProfileScheduler(SEGMENTS, apply=lambda setpoints: None, tick=tick, speed=speed)
+
+
+def test_setpoints_follow_the_timeline():
+    segments = parse_timeline([{'type': 'ramp', 'duration': 10, 'cpu': [0, 100]},
+                               {'type': 'constant', 'duration': 5, 'memory': 30}])
+    scheduler = ProfileScheduler(segments, apply=lambda setpoints: None, tick=0.05)
+    assert scheduler.duration == 15
+    assert scheduler.setpoints_at(5) == {'cpu': pytest.approx(50)}
+    assert scheduler.setpoints_at(12) == {'memory': 30}
@@ -0,0 +1,69 @@
+import math
+import random
+
+import pytest
+
+from traffic import LatencyHistogram, TrafficGenerator, check_target
+
+
+@pytest.mark.parametrize('bits', [7, 8])
+def test_bucket_bounds(bits):
+    histogram = LatencyHistogram(max_value=10_000_000, sub_bucket_bits=bits)
+    worst = 0.0
+    for value in list(range(1, 5000)) + random.Random(1).sample(range(5000, 10_000_000), 5000):
+        index = histogram._index(value)
+        high = histogram._highest_equivalent(index)
+        # The bucket's upper bound covers the value, and the next value starts a new bucket
+        assert value <= high
+        assert histogram._index(high) == index
+        assert histogram._index(high + 1) == index + 1
+        worst = max(worst, (high - value) / value)
+    assert worst <= 1 / 2 ** (bits - 1)
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in range(256):
+        assert histogram._highest_equivalent(histogram._index(value)) == value
+
+
+def test_percentiles_stay_within_bounds():
+    histogram = LatencyHistogram()
+    rng = random.Random(2)
+    values = [rng.randint(100, 2_000_000) for _ in range(10_000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for percent in (50, 90, 99, 99.9, 100):
+        exact = values[max(1, math.ceil(percent / 100 * len(values))) - 1]
+        reported = histogram.percentile(percent)
+        assert exact <= reported <= exact * (1 + 1 / 128)
+    assert histogram.percentile(100) == histogram.max == values[-1]
+
+
+def test_merge_and_clamp():
+    first, second = LatencyHistogram(max_value=1000), LatencyHistogram(max_value=1000)
+    first.record(10)
+    second.record(5000)
+    first.merge(second)
+    assert first.count == 2
+    assert (first.min, first.max) == (10, 1000)
+    assert LatencyHistogram().percentile(50) is None
+
+
+@pytest.mark.parametrize('method', ['GET / HTTP/1.1\r\nX:', 'BREW', ''])
+def test_rejects_unsupported_methods(method):
+    with pytest.raises(ValueError):
+        TrafficGenerator('http://127.0.0.1/', method=method)
+
+
+@pytest.mark.parametrize('url', ['http://127.0.0.1/x\r\nX: y', 'http://127.0.0.1/a b', 'ftp://127.0.0.1/'])
+def test_rejects_unsafe_urls(url):
+    with pytest.raises(ValueError):
+        TrafficGenerator(url)
+
+
+def test_check_target():
+    check_target('http://127.0.0.1:5000/work/cpu', allowed=['127.0.0.1'])
+    with pytest.raises(ValueError):
+        check_target('http://example.com/', allowed=['127.0.0.1'])
@@ -0,0 +1,499 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+from array import array
+from urllib.parse import urlsplit
+
+from logutil import get_logger, log_event
+
+log = get_logger('traffic')
+
+USER_AGENT = 'loadgen-traffic/1'
+
+# Hosts the API may send traffic to: this pod and its Service unless configured otherwise.
+# Add the LoadBalancer address here to load every replica through it.
+ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get(
+    'TRAFFIC_ALLOWED_HOSTS', f"localhost,127.0.0.1,::1,{socket.gethostname()},flask-app-service").split(',')
+    if host.strip()]
+
+# Percentiles reported for every latency histogram
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Request methods the generator sends; anything else would be written into the request line verbatim
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class LatencyHistogram:
+    def __init__(self, max_value=3_600_000_000, sub_bucket_bits=8):
+        """
+        Log-linear latency histogram in the style of HdrHistogram
+
+        Values (whole microseconds) below 2**sub_bucket_bits are counted exactly;
+        above that each power of two is split into 2**(sub_bucket_bits - 1) equal
+        buckets, so a reported value is off by at most 1 / 2**(sub_bucket_bits - 1)
+        of the true one: under 0.8% at the default 8 bits. Memory use is fixed by
+        max_value, and larger values are clamped to it.
+
+        Args:
+            max_value: Largest trackable value in microseconds (default one hour)
+            sub_bucket_bits: Precision in bits (8 keeps every value within 0.8%)
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value = max_value
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._counts = array('Q', [0]) * (self._index(max_value) + 1)
+
+    def _index(self, value):
+        bits = self.sub_bucket_bits
+        shift = value.bit_length() - bits
+        if shift <= 0:
+            return value
+        half = 1 << (bits - 1)
+        return (1 << bits) + (shift - 1) * half + (value >> shift) - half
+
+    def _highest_equivalent(self, index):
+        """Largest value that lands in the bucket at `index`"""
+        bits = self.sub_bucket_bits
+        if index < 1 << bits:
+            return index
+        half = 1 << (bits - 1)
+        shift, offset = divmod(index - (1 << bits), half)
+        shift += 1
+        return ((offset + half + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = min(max(int(value), 0), self.max_value)
+        self._counts[self._index(value)] += count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_seconds(self, seconds):
+        self.record(round(seconds * 1_000_000))
+
+    def merge(self, other):
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for attr, pick in (('min', min), ('max', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr)) if v is not None]
+            setattr(self, attr, pick(values) if values else None)
+
+    def percentile(self, percent):
+        """Nearest-rank percentile in microseconds, or None if empty"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def as_dict(self):
+        """Summary in milliseconds"""
+        def ms(value):
+            return None if value is None else value / 1000
+
+        summary = {
+            'count': self.count,
+            'min': ms(self.min),
+            'mean': ms(self.total / self.count) if self.count else None,
+            'max': ms(self.max),
+        }
+        for percent in PERCENTILES:
+            summary[f"p{percent:g}".replace('.', '')] = ms(self.percentile(percent))
+        return summary
+
+
+class HttpError(Exception):
+    """The server sent something that isn't a valid HTTP/1.1 response"""
+
+
+class _Connection:
+    def __init__(self, host, port, tls):
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        context = ssl.create_default_context() if self.tls else None
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def exchange(self, request, method):
+        """Send one request and read the whole response; returns the status code"""
+        if self.writer is None:
+            await self.open()
+        self.writer.write(request)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed before the response")
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+            raise HttpError(f"Bad status line {status_line[:80]!r}")
+        status = int(parts[1])
+        keep_alive = parts[0] == b'HTTP/1.1'
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get(b'connection', b'').lower()
+        if connection == b'close':
+            keep_alive = False
+        elif connection == b'keep-alive':
+            keep_alive = True
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            pass
+        elif b'chunked' in headers.get(b'transfer-encoding', b'').lower():
+            await self._read_chunked()
+        elif b'content-length' in headers:
+            await self.reader.readexactly(int(headers[b'content-length']))
+        else:
+            # No framing: the body runs until the server closes the connection
+            await self.reader.read()
+            keep_alive = False
+
+        if not keep_alive:
+            self.close()
+        return status
+
+    async def _read_chunked(self):
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                break
+            await self.reader.readexactly(size + 2)
+        # Trailers
+        while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, url, size, method='GET', body=b'', headers=None):
+        """
+        Keep-alive HTTP/1.1 connections to one origin, opened on first use and reused
+
+        Args:
+            url: Target URL (http or https)
+            size: Maximum number of open connections
+            method: Request method
+            body: Request body
+            headers: Extra request headers
+        """
+        parts = _parse_url(url)
+        if size < 1:
+            raise ValueError("At least one connection is needed")
+        tls = parts.scheme == 'https'
+        port = parts.port or (443 if tls else 80)
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", f"User-Agent: {USER_AGENT}",
+                 "Accept: */*", "Connection: keep-alive"]
+        if body or method in ('POST', 'PUT', 'PATCH'):
+            lines.append(f"Content-Length: {len(body)}")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+
+        self.method = method
+        self.size = size
+        self.request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+        self.reconnects = 0
+        self._idle = asyncio.LifoQueue()
+        for _ in range(size):
+            self._idle.put_nowait(_Connection(parts.hostname, port, tls))
+
+    async def send(self):
+        """
+        Make one request on a pooled connection, waiting for one to free up
+
+        Returns:
+            (status code, perf_counter time the request got its connection)
+        """
+        connection = await self._idle.get()
+        sent = time.perf_counter()
+        reused = connection.writer is not None
+        try:
+            try:
+                return await connection.exchange(self.request, self.method), sent
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection; retry once on a fresh one
+                connection.close()
+                self.reconnects += 1
+                return await connection.exchange(self.request, self.method), sent
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+def _parse_url(url):
+    # The path goes into the request line as is, so it mustn't be able to end it early
+    if any(c.isspace() or not c.isprintable() for c in url):
+        raise ValueError(f"URL contains whitespace or control characters: {url!r}")
+    parts = urlsplit(url)
+    try:
+        parts.port
+    except ValueError:
+        raise ValueError(f"Invalid port in '{url}'")
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"Expected an http(s) URL, got '{url}'")
+    return parts
+
+
+def check_target(url, allowed=None):
+    """Raise ValueError unless the URL's host is in `allowed` (default ALLOWED_HOSTS)"""
+    host = _parse_url(url).hostname.lower()
+    if host not in (ALLOWED_HOSTS if allowed is None else allowed):
+        raise ValueError(f"Host '{host}' is not an allowed traffic target (see TRAFFIC_ALLOWED_HOSTS)")
+
+
+def _error_kind(error):
+    """Bucket a failed request for the results: timeout, connect, disconnected or protocol"""
+    if isinstance(error, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(error, (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError)):
+        return 'disconnected'
+    if isinstance(error, OSError):
+        return 'connect'
+    return 'protocol'
+
+
+class TrafficGenerator:
+    def __init__(self, url, rps=None, concurrency=10, duration=60, connections=None, method='GET', body=b'',
+                 timeout=10.0):
+        """
+        Drive HTTP requests at a target, open-loop at a fixed rate or closed-loop at a fixed concurrency
+
+        At a fixed rate each request has an intended start time on a fixed schedule,
+        and its latency is measured from that time rather than from when it was
+        actually sent. Requests that queue behind a slow server therefore show up
+        in the percentiles instead of being silently delayed (coordinated omission).
+        Timed-out requests are included too, at their latency up to the timeout.
+        `service_time` holds the uncorrected send-to-response times of completed
+        requests for comparison.
+
+        Args:
+            url: Target URL
+            rps: Requests per second; None runs closed-loop at `concurrency` instead
+            concurrency: Requests kept in flight in closed-loop mode
+            duration: How long to send for (seconds)
+            connections: Keep-alive connections to use (default: concurrency, or enough for rps)
+            method: Request method, one of METHODS
+            body: Request body
+            timeout: Seconds before a request counts as timed out
+        """
+        if method.upper() not in METHODS:
+            raise ValueError(f"Unsupported method {method!r}, expected one of: {', '.join(METHODS)}")
+        if rps is not None and rps <= 0:
+            raise ValueError("rps must be positive")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if duration <= 0 or timeout <= 0:
+            raise ValueError("duration and timeout must be positive")
+        self.url = url
+        self.rps = rps
+        self.concurrency = concurrency
+        self.duration = duration
+        self.connections = connections or (min(256, max(4, math.ceil(rps / 50))) if rps else concurrency)
+        self.method = method.upper()
+        self.body = body
+        self.timeout = timeout
+        # Fail on a bad URL now rather than in the background thread
+        _parse_url(url)
+
+        self.latency = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.sent = 0
+        self.statuses = {}
+        self.errors = {}
+        self.running = False
+        self.started_at = None
+        self.elapsed = 0.0
+        self._start = None
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def mode(self):
+        return 'rate' if self.rps else 'concurrency'
+
+    def _record(self, intended, sent, finished, status=None, error=None):
+        if error is not None:
+            kind = _error_kind(error)
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if kind == 'timeout':
+                # The slowest requests must stay in the percentiles; count them at least up to when we gave up
+                self.latency.record_seconds(finished - intended)
+            return
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency.record_seconds(finished - intended)
+        self.service_time.record_seconds(finished - sent)
+
+    async def _request(self, pool, intended):
+        try:
+            status, sent = await asyncio.wait_for(pool.send(), self.timeout)
+        except Exception as e:
+            self._record(intended, None, time.perf_counter(), error=e)
+        else:
+            self._record(intended, sent, time.perf_counter(), status=status)
+
+    async def _open_loop(self, pool, start, end):
+        interval = 1 / self.rps
+        in_flight = set()
+        index = 0
+        while not self._stop.is_set():
+            intended = start + index * interval
+            if intended >= end:
+                break
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Requests are issued on schedule even if earlier ones are still waiting for a connection
+            task = asyncio.ensure_future(self._request(pool, intended))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            self.sent += 1
+            index += 1
+        if in_flight:
+            # Every request times out on its own, so this only waits for the last ones to be recorded
+            await asyncio.wait(in_flight, timeout=self.timeout + 1)
+
+    async def _closed_loop(self, pool, end):
+        async def worker():
+            while not self._stop.is_set() and time.perf_counter() < end:
+                self.sent += 1
+                await self._request(pool, time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def run(self):
+        """Send traffic for the configured duration (or until stop()); returns the results"""
+        pool = ConnectionPool(self.url, self.connections, method=self.method, body=self.body)
+        self.running = True
+        self.started_at = time.time()
+        start = self._start = time.perf_counter()
+        log_event(log, 'traffic_started', url=self.url, mode=self.mode, rps=self.rps,
+                  concurrency=self.concurrency, connections=self.connections, duration=self.duration)
+        try:
+            if self.rps:
+                await self._open_loop(pool, start, start + self.duration)
+            else:
+                await self._closed_loop(pool, start + self.duration)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self.reconnects = pool.reconnects
+            pool.close()
+            self.running = False
+        results = self.results()
+        log_event(log, 'traffic_finished', requests=results['requests'], errors=sum(self.errors.values()),
+                  throughput_rps=round(results['throughput_rps'], 1), p99_ms=results['latency_ms']['p99'])
+        return results
+
+    def _run_in_thread(self):
+        try:
+            asyncio.run(self.run())
+        except Exception:
+            self.running = False
+            log.exception('traffic_failed')
+
+    def start(self):
+        """Run in a background thread with its own event loop"""
+        self.running = True
+        self._thread = threading.Thread(target=self._run_in_thread, name="traffic-generator", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.timeout + 1 if timeout is None else timeout)
+
+    def results(self):
+        elapsed = time.perf_counter() - self._start if self.running and self._start else self.elapsed
+        completed = sum(self.statuses.values())
+        return {
+            'url': self.url,
+            'running': self.running,
+            'mode': self.mode,
+            'target_rps': self.rps,
+            'concurrency': self.concurrency if not self.rps else None,
+            'connections': self.connections,
+            'duration': self.duration,
+            'elapsed': elapsed,
+            'requests': self.sent,
+            'completed': completed,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'reconnects': self.reconnects,
+            'throughput_rps': completed / elapsed if elapsed else 0.0,
+            'latency_ms': self.latency.as_dict(),
+            'service_time_ms': self.service_time.as_dict(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send HTTP traffic at a URL and report latency percentiles as JSON")
+    parser.add_argument('url', help="Target URL, e.g. http://localhost:5000/work/cpu?ms=10")
+    parser.add_argument('--rps', type=float, help="Open-loop request rate (default: closed loop at --concurrency)")
+    parser.add_argument('--concurrency', type=int, default=10, help="Requests in flight in closed-loop mode")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to send for")
+    parser.add_argument('--connections', type=int, help="Keep-alive connections to open")
+    parser.add_argument('--method', default='GET', type=str.upper, choices=METHODS)
+    parser.add_argument('--timeout', type=float, default=10.0, help="Per-request timeout in seconds")
+    args = parser.parse_args(argv)
+
+    # Keep stdout for the results; progress events go to stderr
+    for handler in logging.getLogger('loadgen').handlers:
+        handler.setStream(sys.stderr)
+
+    try:
+        generator = TrafficGenerator(args.url, rps=args.rps, concurrency=args.concurrency, duration=args.duration,
+                                     connections=args.connections, method=args.method, timeout=args.timeout)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        results = asyncio.run(generator.run())
+    except KeyboardInterrupt:
+        results = generator.results()
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()